@@ -18,16 +18,28 @@
 
 # Author: Adhi Hargo (cadmus.sw@gmail.com)
 
+import cProfile
+import csv
+import functools
+import io
+import json
 import math
+import pstats
 import random
 import re
+import time
+from collections import OrderedDict, deque
 
+import bmesh
 import bpy
+import numpy as np
 import rigify
 from bpy.app.handlers import persistent
-from bpy.props import BoolProperty, BoolVectorProperty, EnumProperty, FloatProperty, PointerProperty, StringProperty
+from bpy.props import BoolProperty, BoolVectorProperty, CollectionProperty, EnumProperty, FloatProperty, IntProperty, \
+    PointerProperty, StringProperty
 from bpy.types import Menu, Operator, Panel
-from mathutils import Matrix, Vector
+from bpy_extras.io_utils import ExportHelper
+from mathutils import Matrix, Vector, kdtree
 
 bl_info = {
     "name": "ADH Rigging Tools",
@@ -46,6 +58,1039 @@ PRF_TIP = "tip-"
 PRF_HOOK = "hook-"
 BBONE_BASE_SIZE = 0.01
 
+NUMBER_PATTERN = r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?"
+# Expressions of the form "[k *] var [* k | / k] [+ c | - c]"
+LINEAR_EXPRESSION_RE = re.compile(
+    r"^\s*\(?\s*(?:(?P<pre>%(n)s)\s*\*\s*)?(?P<var>[A-Za-z_]\w*)"
+    r"(?:\s*(?P<op>[*/])\s*(?P<post>%(n)s))?\s*\)?"
+    r"(?:\s*(?P<sign>[+-])\s*(?P<offset>%(n)s))?\s*$" % dict(n=NUMBER_PATTERN))
+
+INTEGER_RE = re.compile(r"\d+")
+IDENTIFIER_RE = re.compile(r"[A-Za-z_]\w*")
+INCREMENT_RE = re.compile(r"(\d+)\D*([+-])\D*(\d+)\D*")
+# Side suffixes ".L", "_r", "-Left" etc., with the separator kept on flipping
+SIDE_SUFFIX_RE = re.compile(r"([._-])(L|R|l|r|Left|Right|left|right)$")
+SIDE_SUFFIX_FLIPS = dict(L='R', R='L', l='r', r='l', Left='Right', Right='Left',
+                         left='right', right='left')
+# Constraint attributes holding bone names, remapped when copying stacks
+CONSTRAINT_SUBTARGET_ATTRIBUTES = ['subtarget', 'pole_subtarget']
+DRIVER_TARGET_ATTRIBUTES = ['bone_target', 'data_path', 'transform_type',
+                            'transform_space', 'rotation_mode']
+
+# Driver F-curve settings kept when a driver is re-added
+DRIVER_FCURVE_ATTRIBUTES = ['extrapolation', 'mute', 'lock', 'hide', 'select',
+                            'color_mode', 'color']
+
+# Driver-holding ID types and their bpy.data collections
+DRIVER_ID_COLLECTIONS = OrderedDict([
+    ('OBJECT', 'objects'), ('MESH', 'meshes'), ('KEY', 'shape_keys'),
+    ('ARMATURE', 'armatures'), ('LATTICE', 'lattices'), ('CURVE', 'curves'),
+    ('MATERIAL', 'materials'), ('TEXTURE', 'textures'), ('PARTICLE', 'particles'),
+    ('LAMP', 'lamps'), ('CAMERA', 'cameras'), ('WORLD', 'worlds'),
+    ('SCENE', 'scenes'), ('NODETREE', 'node_groups')])
+
+# RNA type of ID pointers in constraint and modifier settings -> bpy.data collection
+ID_RNA_COLLECTIONS = dict(
+    Object='objects', Action='actions', Texture='textures', Image='images',
+    Curve='curves', Mesh='meshes', Lattice='lattices', Armature='armatures',
+    Group='groups', Material='materials', Scene='scenes', Camera='cameras')
+# Modifier type -> object pointer it can't work without
+MODIFIER_OBJECT_ATTRIBUTES = dict(
+    LATTICE='object', HOOK='object', ARMATURE='object', CURVE='object',
+    MESH_DEFORM='object', SHRINKWRAP='target')
+PRUNE_JOURNAL_NAME = 'adh_prune_journal'
+
+# Source mesh name -> (coordinate signature, KD-tree)
+_kdtree_cache = {}
+
+# Operator instrumentation state, set from add-on preferences
+_instrumentation = dict(profile=False, depth=0)
+_instrumented_methods = {}  # (class, method name) -> original method
+_operator_log = deque(maxlen=100)
+# Selection facts shared by operator polls, see get_selection_facts()
+_selection_facts = dict(key=None, facts=None)
+# Widget object usage, see get_widget_index()
+_widget_index = dict(index=None)
+
+
+def transform_coordinates(matrix, coordinates):
+    """Transforms an (N, 3) coordinate array with a 4x4 matrix in one pass."""
+    mat = np.array(matrix, dtype=np.float64)
+    return np.dot(coordinates, mat[:3, :3].T) + mat[:3, 3]
+
+
+def get_vertex_coordinates(obj, world=True):
+    """Bulk-reads a mesh object's vertex coordinates as an (N, 3) array."""
+    vertices = obj.data.vertices
+    coordinates = np.empty(len(vertices) * 3, dtype=np.float32)
+    vertices.foreach_get('co', coordinates)
+    coordinates = coordinates.reshape(-1, 3)
+    if world:
+        return transform_coordinates(obj.matrix_world, coordinates)
+    return coordinates
+
+
+def get_vertex_selection(obj):
+    """Bulk-reads a mesh object's vertex selection state as a boolean array."""
+    vertices = obj.data.vertices
+    selection = np.zeros(len(vertices), dtype=bool)
+    vertices.foreach_get('select', selection)
+    return selection
+
+
+def get_selected_vertices(obj):
+    """Returns indices and local coordinates of a mesh object's selected vertices.
+
+    In Edit mode they're read straight from the edit mesh, so there's no
+    need to write the whole edit mesh back to mesh data first. In Object
+    mode they're bulk-read from mesh data."""
+    if obj.mode == 'EDIT':
+        bm = bmesh.from_edit_mesh(obj.data)
+        bm.verts.index_update()
+        verts = [v for v in bm.verts if v.select]
+        indices = np.array([v.index for v in verts], dtype=np.int64)
+        coordinates = np.array([v.co[:] for v in verts], dtype=np.float32).reshape(-1, 3)
+        return indices, coordinates
+    selection = get_vertex_selection(obj)
+    return np.flatnonzero(selection), get_vertex_coordinates(obj, world=False)[selection]
+
+
+def set_collection_tail(collection, attr, values, dtype=np.float32):
+    """Bulk-sets an attribute of the last len(values) items of a collection.
+
+    New edit bones are appended at the end of the collection, so this sets
+    all their heads, tails, layers etc. with one foreach_get/foreach_set pair."""
+    values = np.asarray(values, dtype=dtype)
+    item_size = values.size // len(values)
+    data = np.empty(len(collection) * item_size, dtype=dtype)
+    collection.foreach_get(attr, data)
+    data[len(data) - values.size:] = values.ravel()
+    collection.foreach_set(attr, data)
+
+
+def get_vertex_weights(obj):
+    """Returns an (N vertices, N vertex groups) array of the mesh object's weights."""
+    group_count = len(obj.vertex_groups)
+    weights = np.zeros((len(obj.data.vertices), group_count), dtype=np.float32)
+    for vert in obj.data.vertices:
+        for g in vert.groups:
+            if g.group < group_count:
+                weights[vert.index, g.group] = g.weight
+    return weights
+
+
+def get_vertex_group_weights(obj, group_index):
+    """Returns an array of each vertex's weight in one vertex group (mesh or lattice)."""
+    elements = obj.data.vertices if obj.type == 'MESH' else obj.data.points
+    weights = np.zeros(len(elements), dtype=np.float32)
+    for index, element in enumerate(elements):
+        for g in element.groups:
+            if g.group == group_index:
+                weights[index] = g.weight
+                break
+    return weights
+
+
+def assign_vertex_weights(vg, indices, weights):
+    """Adds vertices to a vertex group with one call per distinct weight value."""
+    indices = np.asarray(indices)
+    weights = np.asarray(weights)
+    if not len(indices):
+        return
+    values, inverse = np.unique(weights, return_inverse=True)
+    order = np.argsort(inverse, kind='mergesort')
+    splits = np.cumsum(np.bincount(inverse))[:-1]
+    for value, chunk in zip(values, np.split(indices[order], splits)):
+        if value > 0.0:
+            vg.add(chunk.tolist(), float(value), 'REPLACE')
+
+
+class ADH_ArmatureModeBatch:
+    """Collects edit-bone and pose-bone work on an armature, and runs each phase once.
+
+    Each mode switch rebuilds edit-bone and pose data, so instead of hopping
+    EDIT -> POSE -> previous mode for every step, tasks are queued and run
+    with the fewest possible transitions. Edit tasks are called with the
+    armature's edit bones, pose tasks with its pose bones."""
+
+    def __init__(self, context, armature):
+        self.context = context
+        self.armature = armature
+        self.edit_tasks = []
+        self.pose_tasks = []
+        self.timings = {}
+
+    def add_edit_task(self, func, *args):
+        self.edit_tasks.append((func, args))
+
+    def add_pose_task(self, func, *args):
+        self.pose_tasks.append((func, args))
+
+    def set_mode(self, mode):
+        if self.armature.mode == mode:
+            return
+        start = time.perf_counter()
+        bpy.ops.object.mode_set(mode=mode)
+        self.timings['mode_switch'] += time.perf_counter() - start
+        self.timings['mode_switches'] += 1
+
+    def run(self):
+        """Runs all queued tasks, returns timing breakdown in seconds."""
+        objects = self.context.scene.objects
+        prev_active = objects.active
+        objects.active = self.armature
+        prev_mode = self.armature.mode
+        self.timings = dict(edit=0.0, pose=0.0, mode_switch=0.0, mode_switches=0)
+        start_total = time.perf_counter()
+
+        if self.edit_tasks:
+            self.set_mode('EDIT')
+            start = time.perf_counter()
+            edit_bones = self.armature.data.edit_bones
+            for func, args in self.edit_tasks:
+                func(edit_bones, *args)
+            self.timings['edit'] = time.perf_counter() - start
+
+        if self.pose_tasks:
+            # Pose bones are valid in any mode except Edit, so leaving Edit
+            # mode directly to the previous mode saves one transition.
+            self.set_mode('POSE' if prev_mode == 'EDIT' else prev_mode)
+            start = time.perf_counter()
+            pose_bones = self.armature.pose.bones
+            for func, args in self.pose_tasks:
+                func(pose_bones, *args)
+            self.timings['pose'] = time.perf_counter() - start
+
+        self.set_mode(prev_mode)
+        objects.active = prev_active
+        self.edit_tasks = []
+        self.pose_tasks = []
+        self.timings['total'] = time.perf_counter() - start_total
+
+        return self.timings
+
+
+def time_frames(scene, frames):
+    """Returns seconds spent evaluating the scene at each frame in turn."""
+    start = time.perf_counter()
+    for frame in frames:
+        scene.frame_set(frame)
+    return time.perf_counter() - start
+
+
+def write_fcurve_keyframes(action, data_path, index, group, frames, values):
+    """Replaces an F-curve's keyframes within the frame range with one bulk write.
+
+    The F-curve is edited in place, so keyframes outside the range keep
+    their interpolation and handles, and the curve its modifiers and
+    settings. New points are added at once and set with a single foreach_set."""
+    frames = np.asarray(frames, dtype=np.float32)
+    points = np.column_stack((frames, np.asarray(values, dtype=np.float32)))
+    fc = action.fcurves.find(data_path, index)
+    if fc:
+        existing = np.empty(len(fc.keyframe_points) * 2, dtype=np.float32)
+        fc.keyframe_points.foreach_get('co', existing)
+        existing_frames = existing[0::2]
+        inside = (existing_frames >= frames[0]) & (existing_frames <= frames[-1])
+        # Backwards, so remaining indices stay valid
+        for point_index in np.flatnonzero(inside)[::-1]:
+            fc.keyframe_points.remove(fc.keyframe_points[int(point_index)], fast=True)
+    else:
+        fc = action.fcurves.new(data_path, index, group)
+    kept_count = len(fc.keyframe_points)
+    fc.keyframe_points.add(len(points))
+    coordinates = np.empty(len(fc.keyframe_points) * 2, dtype=np.float32)
+    fc.keyframe_points.foreach_get('co', coordinates)
+    coordinates[kept_count * 2:] = points.ravel()
+    fc.keyframe_points.foreach_set('co', coordinates)
+    fc.update()  # Sorts keyframes and recalculates handles
+    return fc
+
+
+def report_batch_timings(operator, item_count, timings):
+    operator.report({'INFO'}, "%d items: edit %.3fs, pose %.3fs, %d mode switches %.3fs" %
+                    (item_count, timings['edit'], timings['pose'],
+                     timings['mode_switches'], timings['mode_switch']))
+
+
+def ensure_armature_modifier(obj, armature):
+    """Returns obj's Armature modifier deforming with armature, creating one if none exist."""
+    armature_mods = [m for m in obj.modifiers
+                     if m.type == 'ARMATURE' and m.object == armature]
+    if armature_mods:
+        am = armature_mods[0]
+    else:
+        am = obj.modifiers.new('Armature', 'ARMATURE')
+        am.object = armature
+    am.use_vertex_groups = True  # Bound weights do nothing with envelopes only
+    return am
+
+
+def bind_points_to_bones(obj, armature, bone_names, point_indices, weights=None):
+    """Binds points (vertices or lattice points) to bones through vertex groups and a single Armature modifier.
+
+    Without weights, each point goes to the bone of the same index with full
+    weight. Otherwise weights is a (N points, N bones) array."""
+    point_indices = np.asarray(point_indices)
+    for bone_index, bone_name in enumerate(bone_names):
+        vg = obj.vertex_groups.get(bone_name, None)
+        if not vg:
+            vg = obj.vertex_groups.new(bone_name)
+        if weights is None:
+            vg.add([int(point_indices[bone_index])], 1.0, 'REPLACE')
+        else:
+            column = weights[:, bone_index]
+            affected = column > 0.0
+            assign_vertex_weights(vg, point_indices[affected], column[affected])
+    return ensure_armature_modifier(obj, armature)
+
+
+def cluster_points_kmeans(coordinates, count, iterations=50):
+    """Groups an (N, 3) coordinate array into count clusters, returns (centroids, labels)."""
+    coordinates = np.asarray(coordinates, dtype=np.float64)
+
+    # Deterministic farthest-point initialization
+    first = np.argmin(np.linalg.norm(coordinates - coordinates.mean(axis=0), axis=1))
+    centroids = [coordinates[first]]
+    min_distances = np.linalg.norm(coordinates - centroids[0], axis=1)
+    for i in range(1, count):
+        centroids.append(coordinates[np.argmax(min_distances)])
+        min_distances = np.minimum(min_distances,
+                                   np.linalg.norm(coordinates - centroids[-1], axis=1))
+    centroids = np.array(centroids)
+
+    labels = None
+    for i in range(iterations):
+        distances = np.linalg.norm(coordinates[:, np.newaxis] - centroids[np.newaxis], axis=2)
+        new_labels = np.argmin(distances, axis=1)
+        if labels is not None and np.array_equal(labels, new_labels):
+            break
+        labels = new_labels
+        sizes = np.bincount(labels, minlength=count)
+        occupied = sizes > 0  # Empty clusters keep their previous centroid
+        for axis in range(3):
+            sums = np.bincount(labels, weights=coordinates[:, axis], minlength=count)
+            centroids[occupied, axis] = sums[occupied] / sizes[occupied]
+
+    # Drop clusters left empty, renumbering labels accordingly
+    used, labels = np.unique(labels, return_inverse=True)
+    return centroids[used], labels
+
+
+def cluster_points_grid(coordinates, count):
+    """Groups an (N, 3) coordinate array by a regular grid of about count cells, returns (centroids, labels)."""
+    coordinates = np.asarray(coordinates, dtype=np.float64)
+    bbox_min = coordinates.min(axis=0)
+    extents = coordinates.max(axis=0) - bbox_min
+    flat_axes = extents < 1e-6
+    dimensions = max(3 - flat_axes.sum(), 1)
+    cell_size = (np.prod(extents[~flat_axes]) / count) ** (1.0 / dimensions) \
+        if not flat_axes.all() else 1.0
+
+    divisions = np.maximum(np.round(extents / cell_size), 1).astype(np.int64)
+    divisions[flat_axes] = 1
+    cell_sizes = np.where(flat_axes, 1.0, extents / divisions)
+    cells = np.floor((coordinates - bbox_min) / cell_sizes).astype(np.int64)
+    cells = np.minimum(cells, divisions - 1)
+    used, labels = np.unique(cells, axis=0, return_inverse=True)
+    labels = labels.ravel()
+    sizes = np.bincount(labels)
+    centroids = np.column_stack([np.bincount(labels, weights=coordinates[:, axis]) / sizes
+                                 for axis in range(3)])
+    return centroids, labels
+
+
+def get_cluster_weights(coordinates, centroids, labels, overlap):
+    """Returns (N points, N clusters) weights. Zero overlap assigns each point fully to its
+    own cluster, otherwise clusters reach beyond their radius by that factor with linear falloff."""
+    point_count = len(coordinates)
+    weights = np.zeros((point_count, len(centroids)), dtype=np.float32)
+    if overlap <= 0.0:
+        weights[np.arange(point_count), labels] = 1.0
+        return weights
+
+    distances = np.linalg.norm(coordinates[:, np.newaxis] - centroids[np.newaxis], axis=2)
+    radii = np.zeros(len(centroids))
+    np.maximum.at(radii, labels, distances[np.arange(point_count), labels])
+    reach = np.maximum(radii, 1e-6) * (1.0 + overlap)
+
+    weights[:] = np.clip(1.0 - distances / reach, 0.0, None)
+    own = weights[np.arange(point_count), labels]
+    weights[np.arange(point_count), labels] = np.maximum(own, 1e-3)
+    weights /= weights.sum(axis=1, keepdims=True)
+    return weights
+
+
+def get_lattice_deformed_coordinates(scene, obj):
+    """Evaluates only a mesh object's enabled lattice modifiers on its basis shape.
+
+    Returns an (N, 3) local coordinate array, or None if the evaluated
+    mesh's topology doesn't match."""
+    return get_deformed_coordinates(scene, obj, [m for m in obj.modifiers
+                                                 if m.type == 'LATTICE'])
+
+
+def get_deformed_coordinates(scene, obj, modifiers):
+    """Evaluates only the given (enabled) modifiers of a mesh object on its basis shape.
+
+    Returns an (N, 3) local coordinate array, or None if the evaluated
+    mesh's topology doesn't match."""
+    muted_mods = [m for m in obj.modifiers
+                  if m not in modifiers and m.show_viewport]
+    prev_show_only_shape_key = obj.show_only_shape_key
+    prev_shape_key_index = obj.active_shape_key_index
+    for m in muted_mods:
+        m.show_viewport = False
+    obj.show_only_shape_key = True
+    obj.active_shape_key_index = 0
+    try:
+        deformed = obj.to_mesh(scene, True, 'PREVIEW')
+    finally:
+        for m in muted_mods:
+            m.show_viewport = True
+        obj.show_only_shape_key = prev_show_only_shape_key
+        obj.active_shape_key_index = prev_shape_key_index
+
+    coordinates = None
+    if len(deformed.vertices) == len(obj.data.vertices):
+        coordinates = np.empty(len(deformed.vertices) * 3, dtype=np.float32)
+        deformed.vertices.foreach_get('co', coordinates)
+        coordinates = coordinates.reshape(-1, 3)
+    bpy.data.meshes.remove(deformed)
+
+    return coordinates
+
+
+def get_lattice_axis_weights(u, count, interpolation):
+    """Returns (N, 4) point indices and interpolation weights along one lattice axis.
+
+    u is the coordinate in lattice grid units, same as Blender's lattice
+    deform: four taps around floor(u), indices clamped to the grid."""
+    indices = np.zeros((len(u), 4), dtype=np.int64)
+    weights = np.zeros((len(u), 4), dtype=np.float32)
+    if count < 2:
+        weights[:, 1] = 1.0
+        return indices, weights
+
+    ui = np.floor(u)
+    t = u - ui
+    t2 = t * t
+    t3 = t2 * t
+    if interpolation == 'KEY_LINEAR':
+        weights[:, 1] = 1.0 - t
+        weights[:, 2] = t
+    elif interpolation == 'KEY_BSPLINE':
+        fc = 1.0 / 6.0
+        weights[:, 0] = -fc * t3 + 0.5 * t2 - 0.5 * t + fc
+        weights[:, 1] = 0.5 * t3 - t2 + 2.0 / 3.0
+        weights[:, 2] = -0.5 * t3 + 0.5 * t2 + 0.5 * t + fc
+        weights[:, 3] = fc * t3
+    else:
+        fc = 0.71 if interpolation == 'KEY_CARDINAL' else 0.5
+        weights[:, 0] = -fc * t3 + 2.0 * fc * t2 - fc * t
+        weights[:, 1] = (2.0 - fc) * t3 + (fc - 3.0) * t2 + 1.0
+        weights[:, 2] = (fc - 2.0) * t3 + (3.0 - 2.0 * fc) * t2 + fc * t
+        weights[:, 3] = fc * t3 - fc * t2
+    indices[:] = np.clip(ui[:, np.newaxis].astype(np.int64) + np.arange(-1, 3), 0, count - 1)
+
+    return indices, weights
+
+
+def get_lattice_interpolation_weights(lattice, coordinates):
+    """Returns (N, 64) lattice point indices and weights interpolating lattice-space coordinates."""
+    data = lattice.data
+    counts = (data.points_u, data.points_v, data.points_w)
+    interpolations = (data.interpolation_type_u, data.interpolation_type_v,
+                      data.interpolation_type_w)
+
+    # Grid origin and spacing from the points' undeformed positions
+    point_co = np.empty(len(data.points) * 3, dtype=np.float32)
+    data.points.foreach_get('co', point_co)
+    point_co = point_co.reshape(-1, 3)
+    grid_min = point_co.min(axis=0)
+    grid_size = point_co.max(axis=0) - grid_min
+
+    axis_indices = []
+    axis_weights = []
+    for axis in range(3):
+        step = grid_size[axis] / (counts[axis] - 1) if counts[axis] > 1 else 1.0
+        u = (coordinates[:, axis] - grid_min[axis]) / max(step, 1e-12)
+        indices, weights = get_lattice_axis_weights(u, counts[axis], interpolations[axis])
+        axis_indices.append(indices)
+        axis_weights.append(weights)
+
+    iu, iv, iw = axis_indices
+    wu, wv, ww = axis_weights
+    stride_v = counts[0]
+    stride_w = counts[0] * counts[1]
+    indices = iw[:, :, np.newaxis, np.newaxis] * stride_w + \
+              iv[:, np.newaxis, :, np.newaxis] * stride_v + iu[:, np.newaxis, np.newaxis, :]
+    weights = ww[:, :, np.newaxis, np.newaxis] * wv[:, np.newaxis, :, np.newaxis] * \
+              wu[:, np.newaxis, np.newaxis, :]
+
+    return indices.reshape(len(coordinates), -1), weights.reshape(len(coordinates), -1)
+
+
+def get_lattice_point_bone_weights(lattice):
+    """Returns ([(armature, bone name), ...], (N points, N bones) array) of bones driving lattice points,
+    through bone Hook modifiers or vertex groups of an Armature modifier."""
+    bone_keys = []
+    columns = []
+
+    def get_column(armature, bone_name):
+        key = (armature, bone_name)
+        if key not in bone_keys:
+            bone_keys.append(key)
+            columns.append(np.zeros(len(lattice.data.points), dtype=np.float32))
+        return columns[bone_keys.index(key)]
+
+    for mod in lattice.modifiers:
+        if not mod.show_viewport or not mod.object or mod.object.type != 'ARMATURE':
+            continue
+        if mod.type == 'HOOK' and mod.subtarget:
+            column = get_column(mod.object, mod.subtarget)
+            column[list(mod.vertex_indices)] += mod.strength
+        elif mod.type == 'ARMATURE' and mod.use_vertex_groups:
+            bones = mod.object.data.bones
+            for vg in lattice.vertex_groups:
+                bone = bones.get(vg.name, None)
+                if bone and bone.use_deform:
+                    column = get_column(mod.object, vg.name)
+                    column += get_vertex_group_weights(lattice, vg.index)
+
+    weights = np.column_stack(columns) if columns else \
+        np.zeros((len(lattice.data.points), 0), dtype=np.float32)
+    return bone_keys, weights
+
+
+def get_animatable_datablocks(obj):
+    """Returns datablocks of an object that may hold drivers: shape keys, materials,
+    textures, particle settings, the object and its data."""
+    shape_keys = getattr(obj.data, 'shape_keys', None)
+    datablocks = [shape_keys] if shape_keys else []
+    for ms in obj.material_slots:
+        if not ms or not ms.material:
+            continue
+        datablocks.append(ms.material)
+        for ts in ms.material.texture_slots:
+            if not ts:
+                continue
+            datablocks.append(ts.texture)
+    for ps in obj.particle_systems:
+        datablocks.append(ps.settings)
+    datablocks.append(obj)
+    datablocks.append(obj.data)
+    return datablocks
+
+
+def parse_increments(increment_list_str):
+    """Parses "1+1 2-10" into {1: 1, 2: -10}: increment of each n-th integer in an expression."""
+    increments = {}
+    for match_obj in INCREMENT_RE.finditer(increment_list_str):
+        increment = int(match_obj.group(3))
+        if match_obj.group(2) == '-':
+            increment *= -1
+        increments[int(match_obj.group(1))] = increment
+    return increments
+
+
+class ADH_DriverTemplate:
+    """Snapshot of a driver, applicable to many driver F-curves.
+
+    Expression is tokenized once into literal text and integers, so each
+    copy only joins strings. All variables and all their targets are
+    recorded, including ID type and rotation mode."""
+
+    def __init__(self, driver, fcurve=None):
+        self.type = driver.type
+        self.show_debug_info = driver.show_debug_info
+        self.use_self = getattr(driver, 'use_self', False)
+
+        expression = driver.expression
+        self.literals = INTEGER_RE.split(expression)
+        self.integers = [int(i) for i in INTEGER_RE.findall(expression)]
+
+        self.variables = []
+        for dv in driver.variables:
+            targets = []
+            for target in dv.targets:
+                attributes = dict((attr, getattr(target, attr))
+                                  for attr in DRIVER_TARGET_ATTRIBUTES
+                                  if hasattr(target, attr))
+                targets.append((target.id_type, target.id, attributes))
+            self.variables.append((dv.name, dv.type, targets))
+
+        # Polynomial generators scaling simple (Python-free) drivers
+        self.generators = []
+        if fcurve:
+            for mod in fcurve.modifiers:
+                if mod.type == 'GENERATOR':
+                    self.generators.append((mod.mode, mod.poly_order, mod.use_additive,
+                                            tuple(mod.coefficients)))
+
+    def get_expression(self, index=0, increments=None):
+        """Returns expression with each n-th integer increased by increments[n] * index."""
+        parts = [self.literals[0]]
+        for n, (value, literal) in enumerate(zip(self.integers, self.literals[1:]), 1):
+            if increments:
+                value += increments.get(n, 0) * index
+            parts.append(str(value))
+            parts.append(literal)
+        return ''.join(parts)
+
+    def apply(self, driver, index=0, increments=None):
+        driver.show_debug_info = self.show_debug_info
+        driver.type = self.type
+        driver.expression = self.get_expression(index, increments)
+        if hasattr(driver, 'use_self'):
+            driver.use_self = self.use_self
+
+        variables = driver.variables
+        for dv in reversed(list(variables)):
+            variables.remove(dv)
+        for name, var_type, targets in self.variables:
+            dv = variables.new()
+            dv.name = name
+            dv.type = var_type
+            for target, (id_type, id, attributes) in zip(dv.targets, targets):
+                if var_type == 'SINGLE_PROP':
+                    target.id_type = id_type  # Only editable for this type
+                target.id = id
+                for attr, value in attributes.items():
+                    setattr(target, attr, value)
+
+    def apply_fcurve(self, fc, index=0, increments=None):
+        """Applies driver, and generator modifiers if recorded, to a driver F-curve."""
+        self.apply(fc.driver, index, increments)
+        self.apply_generators(fc)
+
+    def apply_generators(self, fc):
+        if not self.generators:
+            return
+        for mod in [m for m in fc.modifiers if m.type == 'GENERATOR']:
+            fc.modifiers.remove(mod)
+        for mode, poly_order, use_additive, coefficients in self.generators:
+            mod = fc.modifiers.new('GENERATOR')
+            mod.mode = mode
+            mod.poly_order = poly_order
+            mod.use_additive = use_additive
+            mod.coefficients = coefficients
+
+
+def copy_selected_drivers(keyable_list, increments):
+    """Copies topmost selected driver of the datablocks to all other selected ones, with expression increments."""
+    fcurves = [fc for keyable in keyable_list
+               if keyable and keyable.animation_data
+               for fc in keyable.animation_data.drivers if fc.select]
+    if not fcurves:
+        return
+
+    # Topmost selected channel is the template for all others
+    template = ADH_DriverTemplate(fcurves[0].driver)
+    for index, fc in enumerate(fcurves[1:], 1):
+        template.apply(fc.driver, index, increments)
+
+
+def iter_file_drivers():
+    """Yields (datablock, driver F-curve) for every driver reachable from the file's objects."""
+    visited = set()
+    for obj in bpy.data.objects:
+        for datablock in get_animatable_datablocks(obj):
+            if not datablock or not datablock.animation_data \
+                    or datablock.as_pointer() in visited:
+                continue
+            visited.add(datablock.as_pointer())
+            for fc in datablock.animation_data.drivers:
+                yield datablock, fc
+
+
+class ADH_DriverIndex:
+    """Index of every driver F-curve in the file, by ID type, built with a single walk.
+
+    Intended for batch edits from scripts, including background Blender:
+
+        index = ADH_DriverIndex()
+        entries = index.find('KEY', r'key_blocks\["brow.*"\]')
+        index.rewrite_expressions(entries, r'\ba\b', 'var')
+
+    Build a new index after adding or removing driver F-curves, old entries
+    may refer to freed data."""
+
+    def __init__(self):
+        self.entries = []  # (id_type, datablock, fcurve)
+        self.by_type = {}
+        for id_type, collection_name in DRIVER_ID_COLLECTIONS.items():
+            collection = getattr(bpy.data, collection_name, None)
+            if collection is None:
+                continue
+            type_entries = self.by_type.setdefault(id_type, [])
+            for datablock in collection:
+                animation_data = getattr(datablock, 'animation_data', None)
+                if not animation_data:
+                    continue
+                for fc in animation_data.drivers:
+                    type_entries.append((id_type, datablock, fc))
+            self.entries.extend(type_entries)
+
+    def find(self, id_type=None, path_pattern=None):
+        """Returns entries of an ID type (all if None) whose data path matches a regular expression."""
+        entries = self.by_type.get(id_type, []) if id_type else self.entries
+        if not path_pattern:
+            return list(entries)
+        path_re = re.compile(path_pattern)
+        return [entry for entry in entries if path_re.search(entry[2].data_path)]
+
+    @staticmethod
+    def rewrite_expressions(entries, search_pattern, replacement):
+        """Substitutes regular expression matches in scripted drivers' expressions, returns count changed.
+        An empty pattern would match between every character, so it's rejected."""
+        if not search_pattern:
+            raise ValueError("Empty search pattern")
+        search_re = re.compile(search_pattern)
+        count = 0
+        for id_type, datablock, fc in entries:
+            driver = fc.driver
+            if driver.type != 'SCRIPTED':
+                continue
+            expression = search_re.sub(replacement, driver.expression)
+            if expression != driver.expression:
+                driver.expression = expression
+                count += 1
+        return count
+
+    @staticmethod
+    def retarget(entries, old_id, new_id, bone_pattern=None, bone_replacement=''):
+        """Points driver variable targets from one ID to another, optionally renaming
+        their bone targets by regular expression. Returns count of targets changed."""
+        bone_re = re.compile(bone_pattern) if bone_pattern else None
+        count = 0
+        for id_type, datablock, fc in entries:
+            for dv in fc.driver.variables:
+                for target in dv.targets:
+                    if target.id != old_id:
+                        continue
+                    target.id = new_id
+                    if bone_re and target.bone_target:
+                        target.bone_target = bone_re.sub(bone_replacement, target.bone_target)
+                    count += 1
+        return count
+
+    @staticmethod
+    def apply_template(template, entries, increments=None):
+        """Applies a driver template to all entries, the n-th entry with increment index n + 1."""
+        for index, (id_type, datablock, fc) in enumerate(entries, 1):
+            template.apply(fc.driver, index, increments)
+        return len(entries)
+
+
+def get_driver_signature(driver):
+    """Returns a hashable signature equal for drivers computing the same value, or None for drivers
+    not worth sharing (already a single property read, or depending on their owner)."""
+    if getattr(driver, 'use_self', False) or not driver.variables:
+        return None
+    if driver.type != 'SCRIPTED' and len(driver.variables) == 1 \
+            and driver.variables[0].type == 'SINGLE_PROP':
+        return None
+
+    variables = []
+    for dv in driver.variables:
+        targets = tuple((target.id.as_pointer() if target.id else 0, target.id_type) +
+                        tuple(getattr(target, attr, None) for attr in DRIVER_TARGET_ATTRIBUTES)
+                        for target in dv.targets)
+        variables.append(((dv.type, targets), dv.name))
+    variables.sort(key=lambda v: v[0])
+
+    if driver.type != 'SCRIPTED':
+        return driver.type, tuple(v[0] for v in variables)
+
+    # Variables renamed in canonical order, whitespace removed
+    names = dict((name, 'v%d' % i) for i, (var_sig, name) in enumerate(variables))
+    expression = IDENTIFIER_RE.sub(lambda m: names.get(m.group(), m.group()), driver.expression)
+    expression = ''.join(expression.split())
+    return driver.type, expression, tuple(v[0] for v in variables)
+
+
+def set_driver_property_reader(driver, id_type, datablock, data_path):
+    """Makes a driver simply read one property of a datablock."""
+    driver.type = 'AVERAGE'
+    variables = driver.variables
+    for dv in reversed(list(variables)):
+        variables.remove(dv)
+    dv = variables.new()
+    dv.name = 'var'
+    dv.type = 'SINGLE_PROP'
+    target = dv.targets[0]
+    target.id_type = id_type
+    target.id = datablock
+    target.data_path = data_path
+
+
+def parse_linear_expression(expression, var_name):
+    """Returns (scale, offset) if expression is linear in a single variable, else None."""
+    match_obj = LINEAR_EXPRESSION_RE.match(expression)
+    if not match_obj or match_obj.group('var') != var_name:
+        return None
+
+    scale = float(match_obj.group('pre') or 1.0)
+    if match_obj.group('post'):
+        post = float(match_obj.group('post'))
+        if match_obj.group('op') == '/':
+            if post == 0.0:
+                return None
+            post = 1.0 / post
+        scale *= post
+    offset = float(match_obj.group('offset') or 0.0)
+    if match_obj.group('sign') == '-':
+        offset = -offset
+    return scale, offset
+
+
+def get_driver_generator(fc):
+    """Returns driver F-curve's only polynomial Generator modifier, creating one if it has no modifiers.
+    Returns None if keyframes or other modifiers make the F-curve's mapping non-linear."""
+    if fc.keyframe_points:
+        return None  # A Generator would replace the keyframed mapping
+    modifiers = list(fc.modifiers)
+    if not modifiers:
+        return fc.modifiers.new('GENERATOR')
+    if len(modifiers) == 1:
+        mod = modifiers[0]
+        if mod.type == 'GENERATOR' and mod.mode == 'POLYNOMIAL' \
+                and mod.poly_order == 1 and not mod.use_additive:
+            return mod
+    return None
+
+
+def set_driver_linear_mapping(fc, scale, offset):
+    """Makes a driver F-curve map its driver's value with scale and offset through its Generator modifier.
+    Returns False if the F-curve's modifiers don't allow it."""
+    mod = get_driver_generator(fc)
+    if not mod:
+        return False
+    mod.mode = 'POLYNOMIAL'
+    mod.poly_order = 1
+    mod.use_additive = False
+    mod.coefficients = (offset, scale)
+    return True
+
+
+def get_side(name):
+    """Returns 'l' or 'r' for a name with side suffix, None otherwise."""
+    match = SIDE_SUFFIX_RE.search(name)
+    return match.group(2)[0].lower() if match else None
+
+
+def flip_side_suffix(name):
+    """Returns name with its side suffix flipped, or None if it has none."""
+    match = SIDE_SUFFIX_RE.search(name)
+    if not match:
+        return None
+    return name[:match.start()] + match.group(1) + SIDE_SUFFIX_FLIPS[match.group(2)]
+
+
+def get_writable_settings(struct):
+    """Returns a dict of a constraint's or modifier's writable settings, excluding name and type."""
+    return OrderedDict((prop.identifier, getattr(struct, prop.identifier))
+                       for prop in struct.bl_rna.properties
+                       if not prop.is_readonly and
+                       prop.identifier not in ('name', 'type', 'rna_type'))
+
+
+def serialize_setting(value):
+    """Converts a setting value into something JSON can store."""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, bpy.types.ID):
+        return {'id': [value.bl_rna.identifier, value.name]}
+    if isinstance(value, set):
+        return {'set': sorted(value)}
+    if isinstance(value, Matrix):
+        return {'matrix': [list(row) for row in value]}
+    return [serialize_setting(v) for v in value]  # Vectors and property arrays
+
+
+def deserialize_setting(value):
+    if isinstance(value, dict):
+        if 'id' in value:
+            id_type, name = value['id']
+            return getattr(bpy.data, ID_RNA_COLLECTIONS.get(id_type, ''), {}).get(name, None)
+        if 'set' in value:
+            return set(value['set'])
+        if 'matrix' in value:
+            return Matrix(value['matrix'])
+    return value
+
+
+def apply_settings(struct, settings):
+    """Sets each setting that's valid for the struct, skipping the rest."""
+    for attr, value in settings.items():
+        try:
+            setattr(struct, attr, value)
+        except (AttributeError, TypeError, ValueError):
+            pass
+
+
+def update_operator_log_size(size):
+    global _operator_log
+    _operator_log = deque(_operator_log, maxlen=size)
+
+
+def instrument_method(cls, method_name, method):
+    """Returns method wrapped to log its wall-clock time, and optionally its cProfile stats."""
+
+    @functools.wraps(method)
+    def wrapper(self, context, *args):
+        if _instrumentation['depth']:  # e.g. invoke() calling execute()
+            return method(self, context, *args)
+        entry = OrderedDict([
+            ('operator', cls.bl_idname), ('method', method_name),
+            ('time', time.strftime('%H:%M:%S')),
+            ('objects', len(getattr(context, 'selected_objects', None) or [])),
+            ('bones', len(getattr(context, 'selected_pose_bones', None) or
+                          getattr(context, 'selected_bones', None) or []))])
+        profiler = cProfile.Profile() if _instrumentation['profile'] else None
+        _instrumentation['depth'] += 1
+        start = time.perf_counter()
+        try:
+            if profiler:
+                result = profiler.runcall(method, self, context, *args)
+            else:
+                result = method(self, context, *args)
+            entry['result'] = sorted(result)
+            return result
+        except Exception as e:
+            entry['result'] = ['ERROR: %s' % e]
+            raise
+        finally:
+            entry['seconds'] = time.perf_counter() - start
+            _instrumentation['depth'] -= 1
+            if profiler:
+                stream = io.StringIO()
+                pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(20)
+                entry['profile'] = stream.getvalue()
+            _operator_log.append(entry)
+
+    return wrapper
+
+
+def set_operator_instrumentation(enabled):
+    """Wraps (or unwraps) execute and invoke of every ADH operator.
+
+    Methods are swapped on the classes, so there's no overhead at all
+    when instrumentation is off."""
+    if not enabled:
+        for (cls, method_name), method in _instrumented_methods.items():
+            if method is None:
+                delattr(cls, method_name)  # Was inherited
+            else:
+                setattr(cls, method_name, method)
+        _instrumented_methods.clear()
+        return
+    for cls in list(globals().values()):
+        if not (isinstance(cls, type) and issubclass(cls, Operator) and
+                cls.__name__.startswith('ADH_')):
+            continue
+        for method_name in ('execute', 'invoke'):
+            method = getattr(cls, method_name, None)
+            if method is None or (cls, method_name) in _instrumented_methods:
+                continue
+            _instrumented_methods[(cls, method_name)] = cls.__dict__.get(method_name, None)
+            setattr(cls, method_name, instrument_method(cls, method_name, method))
+
+
+class ADH_SelectionFacts:
+    """Selection-derived facts needed by operator polls, computed in one pass.
+
+    Panels and menus call every listed operator's poll on each redraw, and
+    with thousands of selected bones building selection lists there makes
+    the viewport lag. These are shared by all polls until the scene update
+    handler drops them (selection changes included), or the mode or active
+    item changes."""
+
+    def __init__(self, context):
+        selected_objects = context.selected_objects or []
+        self.object_count = len(selected_objects)
+        self.type_counts = {}
+        for obj in selected_objects:
+            self.type_counts[obj.type] = self.type_counts.get(obj.type, 0) + 1
+        pose_bones = context.selected_pose_bones
+        self.pose_bone_count = len(pose_bones) if pose_bones is not None else None
+
+    def count(self, obj_type):
+        return self.type_counts.get(obj_type, 0)
+
+
+def get_selection_facts(context):
+    active = context.active_object
+    active_bone = context.active_pose_bone or context.active_bone
+    key = (context.scene.name, context.mode, active.name if active else None,
+           active_bone.name if active_bone else None)
+    if _selection_facts['key'] != key:
+        _selection_facts['facts'] = ADH_SelectionFacts(context)
+        _selection_facts['key'] = key
+    return _selection_facts['facts']
+
+
+class ADH_WidgetIndex:
+    """Index from custom shape (widget) object name to the bones using it, built with a single walk.
+
+    Going from a bone to its widget is a lookup, going from a widget to its
+    bones is a scan of every pose bone in the file. This index does the scan
+    once; get_widget_index() keeps it until a scene update or custom shape
+    assignment invalidates it."""
+
+    def __init__(self):
+        self.users = {}  # Widget name -> [(armature name, bone name)]
+        for obj in bpy.data.objects:
+            if obj.type != 'ARMATURE' or not obj.pose:
+                continue
+            for pbone in obj.pose.bones:
+                if pbone.custom_shape:
+                    self.users.setdefault(pbone.custom_shape.name, []).append(
+                        (obj.name, pbone.name))
+
+    def get_users(self, widget):
+        return self.users.get(widget.name, [])
+
+    def is_used(self, widget):
+        return widget.name in self.users
+
+    def get_shared(self):
+        """Returns {widget name: armature names} for widgets used by more than one armature."""
+        shared = {}
+        for widget_name, users in self.users.items():
+            armature_names = sorted(set(armature_name for armature_name, bone_name in users))
+            if len(armature_names) > 1:
+                shared[widget_name] = armature_names
+        return shared
+
+
+def get_widget_index():
+    if _widget_index['index'] is None:
+        _widget_index['index'] = ADH_WidgetIndex()
+    return _widget_index['index']
+
+
+def invalidate_widget_index():
+    _widget_index['index'] = None
+
+
+def get_cached_kdtree(obj):
+    """Returns KD-tree of mesh object's world-space vertices, rebuilt only when they change."""
+    coordinates = get_vertex_coordinates(obj)
+    signature = hash(coordinates.tobytes())
+    cached = _kdtree_cache.get(obj.name)
+    if cached and cached[0] == signature:
+        return cached[1]
+
+    tree = kdtree.KDTree(len(coordinates))
+    for index, co in enumerate(coordinates.tolist()):
+        tree.insert(co, index)
+    tree.balance()
+    _kdtree_cache[obj.name] = (signature, tree)
+
+    return tree
+
 
 class ADH_RenameRegex(Operator):
     """Renames selected objects or bones using regular expressions. Depends on re, standard library module."""
@@ -55,7 +1100,7 @@ class ADH_RenameRegex(Operator):
 
     @classmethod
     def poll(cls, context):
-        return context.selected_objects != []
+        return get_selection_facts(context).object_count > 0
 
     def execute(self, context):
         props = context.scene.adh_rigging_tools
@@ -98,7 +1143,7 @@ class ADH_AddSubdivisionSurfaceModifier(Operator):
     @classmethod
     def poll(cls, context):
         return context.mode == 'OBJECT' \
-               and context.selected_objects != []
+               and get_selection_facts(context).object_count > 0
 
     def execute(self, context):
         meshes = [obj for obj in context.selected_objects if obj.type == 'MESH']
@@ -128,10 +1173,54 @@ class ADH_BindToLattice(Operator):
         default=False
     )
 
+    fill_vertex_group = BoolProperty(
+        name="Fill Vertex Group",
+        description="Fill newly created limiting vertex group with vertices inside lattice's volume. " +
+                    "Existing groups are kept as they are.",
+        default=True
+    )
+
+    falloff = FloatProperty(
+        name="Falloff",
+        description="Distance outside lattice's volume where vertex weights fade out.",
+        min=0.0, default=0.0,
+        subtype='DISTANCE', unit='LENGTH'
+    )
+
     @classmethod
     def poll(self, context):
         obj = context.active_object
-        return obj and obj.type == 'LATTICE' and context.selected_objects
+        return obj and obj.type == 'LATTICE' and get_selection_facts(context).object_count > 0
+
+    def get_lattice_weights(self, lattice, obj):
+        """Returns weight of each mesh vertex by its distance outside lattice's volume."""
+        points = lattice.data.points
+        point_co = np.empty(len(points) * 3, dtype=np.float32)
+        points.foreach_get('co', point_co)
+        point_co = point_co.reshape(-1, 3)
+        bbox_min = point_co.min(axis=0)
+        bbox_max = point_co.max(axis=0)
+
+        # Vertices in lattice space, offset outside its bounding box, then
+        # measured in world space.
+        lattice_mat = lattice.matrix_world
+        matrix = lattice_mat.inverted() * obj.matrix_world
+        coordinates = transform_coordinates(matrix, get_vertex_coordinates(obj, world=False))
+        outside = np.maximum(bbox_min - coordinates, 0.0) + \
+                  np.minimum(bbox_max - coordinates, 0.0)
+        lattice_mat_3x3 = np.array(lattice_mat, dtype=np.float64)[:3, :3]
+        distances = np.linalg.norm(np.dot(outside, lattice_mat_3x3.T), axis=1)
+
+        if self.falloff > 0.0:
+            return np.clip(1.0 - distances / self.falloff, 0.0, 1.0)
+        return (distances <= 1e-6).astype(np.float32)
+
+    def fill_lattice_vertex_group(self, lattice, obj, vg):
+        weights = self.get_lattice_weights(lattice, obj)
+        all_indices = np.arange(len(weights))
+        affected = weights > 0.0
+        vg.remove(all_indices.tolist())
+        assign_vertex_weights(vg, all_indices[affected], weights[affected])
 
     def execute(self, context):
         lattice = context.active_object
@@ -152,13 +1241,16 @@ class ADH_BindToLattice(Operator):
                 vg = obj.vertex_groups.get(lattice.name, None)
                 if not vg:
                     vg = obj.vertex_groups.new(lattice.name)
+                    # Only new groups, an existing one may be hand-painted
+                    if self.fill_vertex_group:
+                        self.fill_lattice_vertex_group(lattice, obj, vg)
                 lm.vertex_group = vg.name
 
         return {'FINISHED'}
 
 
 class ADH_ApplyLattices(Operator):
-    """Applies all lattice modifiers, deletes all shapekeys. Used for lattice-initialized shapekey creation."""
+    """Applies all lattice modifiers, deletes all shapekeys of selected meshes. Used for lattice-initialized shapekey creation."""
     bl_idname = 'mesh.adh_apply_lattices'
     bl_label = 'Apply Lattices'
     bl_options = {'REGISTER', 'UNDO'}
@@ -166,18 +1258,311 @@ class ADH_ApplyLattices(Operator):
     @classmethod
     def poll(cls, context):
         return context.mode == 'OBJECT' \
-               and context.selected_objects != [] \
-               and context.active_object.type == 'MESH'
+               and get_selection_facts(context).count('MESH') > 0
+
+    def apply_lattices(self, scene, obj):
+        """Returns False if lattices can't be applied, leaving the mesh and its shape keys as they are."""
+        lattice_mods = [m for m in obj.modifiers
+                        if m.type == 'LATTICE' and m.show_viewport]
+        if not lattice_mods:
+            obj.shape_key_clear()
+            return True
+
+        # Evaluate all lattice modifiers at once (on the basis shape) and
+        # write the result straight to the mesh.
+        coordinates = get_lattice_deformed_coordinates(scene, obj)
+        if coordinates is None:
+            return False
+        obj.shape_key_clear()
+        obj.data.vertices.foreach_set('co', coordinates.ravel())
+        obj.data.update()
+        for m in lattice_mods:
+            obj.modifiers.remove(m)
+        return True
 
     def execute(self, context):
-        obj = context.active_object
-        if obj.data.shape_keys:
-            for i in range(len(obj.data.shape_keys.key_blocks), 0, -1):
-                obj.active_shape_key_index = i - 1
-                bpy.ops.object.shape_key_remove()
-        for m in obj.modifiers:
-            if m.type == 'LATTICE':
-                bpy.ops.object.modifier_apply(modifier=m.name)
+        meshes = [obj for obj in context.selected_objects if obj.type == 'MESH']
+        skipped = [obj.name for obj in meshes if obj.data.users > 1]
+        failed = [obj.name for obj in meshes if obj.name not in skipped
+                  and not self.apply_lattices(context.scene, obj)]
+
+        if skipped:
+            self.report({'WARNING'}, "Skipped multi-user meshes: " + ", ".join(skipped))
+        if failed:
+            self.report({'WARNING'}, "Skipped meshes whose topology other modifiers change: " +
+                        ", ".join(failed))
+
+        return {'FINISHED'}
+
+
+class ADH_BakeLatticeShapeKey(Operator):
+    """Stores lattice deformation of selected meshes as a new shape key, keeping existing ones."""
+    bl_idname = 'mesh.adh_bake_lattice_shape_key'
+    bl_label = 'Bake Lattice to Shape Key'
+    bl_options = {'REGISTER', 'UNDO'}
+
+    shape_name = StringProperty(
+        name="Shape Key Name",
+        description="Name of the new shape key. Empty uses the first lattice's name",
+        default="")
+
+    reset_lattice = BoolProperty(
+        name="Reset Lattice",
+        description="Move lattice points back to their undeformed position afterwards.",
+        default=False)
+
+    @classmethod
+    def poll(cls, context):
+        return context.mode == 'OBJECT' \
+               and get_selection_facts(context).count('MESH') > 0
+
+    def bake_shape_key(self, scene, obj):
+        lattice_mods = [m for m in obj.modifiers
+                        if m.type == 'LATTICE' and m.show_viewport and m.object]
+        if not lattice_mods:
+            return set()
+
+        if not obj.data.shape_keys:
+            obj.shape_key_add(name='Basis', from_mix=False)
+        deformed = get_lattice_deformed_coordinates(scene, obj)
+        if deformed is None:
+            return set()
+
+        shape = obj.shape_key_add(name=self.shape_name or lattice_mods[0].object.name,
+                                  from_mix=False)
+        shape.data.foreach_set('co', deformed.ravel())
+        obj.data.update()
+
+        return set(m.object for m in lattice_mods)
+
+    def reset_lattice_points(self, lattice):
+        points = lattice.data.points
+        coordinates = np.empty(len(points) * 3, dtype=np.float32)
+        points.foreach_get('co', coordinates)
+        points.foreach_set('co_deform', coordinates)
+        lattice.data.update()
+
+    def execute(self, context):
+        meshes = [obj for obj in context.selected_objects if obj.type == 'MESH']
+        lattices = set()
+        for obj in meshes:
+            lattices |= self.bake_shape_key(context.scene, obj)
+
+        # Reset only after all meshes are baked, they may share a lattice.
+        if self.reset_lattice:
+            for lattice in lattices:
+                self.reset_lattice_points(lattice)
+
+        return {'FINISHED'}
+
+
+class ADH_LatticeToArmatureWeights(Operator):
+    """Converts lattice deformation driven by bones into direct armature weights on selected meshes."""
+    bl_idname = 'mesh.adh_lattice_to_armature_weights'
+    bl_label = 'Lattice to Armature Weights'
+    bl_options = {'REGISTER', 'UNDO'}
+
+    remove_lattice_modifiers = BoolProperty(
+        name="Remove Lattice Modifiers",
+        description="Remove converted lattice modifiers instead of disabling them",
+        default=False)
+
+    rest_bone = StringProperty(
+        name="Rest Bone",
+        description="Deform bone taking the weight not driven through the lattice, " +
+                    "created at armature origin if missing",
+        default="lattice_rest")
+
+    tolerance = FloatProperty(
+        name="Tolerance",
+        description="Largest vertex distance between lattice and armature results " +
+                    "for the conversion to be kept",
+        min=0.0, default=1e-3, precision=4)
+
+    CHUNK_SIZE = 32768  # Vertices processed at once, limits memory use
+
+    @classmethod
+    def poll(cls, context):
+        return context.mode == 'OBJECT' \
+               and get_selection_facts(context).count('MESH') > 0
+
+    def get_modifier_bone_weights(self, obj, lm, coordinates, point_weights):
+        """Composes lattice interpolation weights with lattice points' bone weights."""
+        matrix = lm.object.matrix_world.inverted() * obj.matrix_world
+        lattice_co = transform_coordinates(matrix, coordinates)
+        factors = np.full(len(coordinates), lm.strength, dtype=np.float32)
+        vg = obj.vertex_groups.get(lm.vertex_group, None)
+        if vg:
+            factors *= get_vertex_group_weights(obj, vg.index)
+
+        # Sparse product: each vertex only has 64 nonzero interpolation
+        # weights, so accumulate tap by tap instead of a dense matrix.
+        bone_weights = np.zeros((len(coordinates), point_weights.shape[1]), dtype=np.float32)
+        for start in range(0, len(coordinates), self.CHUNK_SIZE):
+            end = start + self.CHUNK_SIZE
+            indices, weights = get_lattice_interpolation_weights(lm.object, lattice_co[start:end])
+            weights *= factors[start:end, np.newaxis]
+            chunk = bone_weights[start:end]
+            for tap in range(indices.shape[1]):
+                chunk += weights[:, tap, np.newaxis] * point_weights[indices[:, tap]]
+
+        return bone_weights
+
+    def create_rest_bone(self, edit_bones):
+        bone = edit_bones.new(self.rest_bone)
+        bone.head = (0, 0, 0)
+        bone.tail = (0, BBONE_BASE_SIZE * 10, 0)
+        bone.use_deform = True
+
+    def ensure_rest_bone(self, context, armature):
+        if self.rest_bone not in armature.data.bones:
+            batch = ADH_ArmatureModeBatch(context, armature)
+            batch.add_edit_task(self.create_rest_bone)
+            batch.run()
+
+    @staticmethod
+    def is_rest_pose(bone_keys):
+        """Returns True if none of the bones is moved from its rest position."""
+        for armature, bone_name in bone_keys:
+            if armature.data.pose_position == 'REST':
+                continue
+            pbone = armature.pose.bones[bone_name]
+            if not np.allclose(np.array(pbone.matrix), np.array(pbone.bone.matrix_local),
+                               atol=1e-5):
+                return False
+        return True
+
+    def get_combined_weights(self, obj, lattice_mods):
+        """Returns {(armature, bone name): vertex weight column} summed over lattices,
+        and lattice modifiers driven by bones."""
+        coordinates = get_vertex_coordinates(obj, world=False)
+        combined = {}
+        converted_mods = []
+        for lm in lattice_mods:
+            bone_keys, point_weights = get_lattice_point_bone_weights(lm.object)
+            if not bone_keys:
+                continue
+            bone_weights = self.get_modifier_bone_weights(obj, lm, coordinates, point_weights)
+            # Displacements of several lattices add up, and so do their weights.
+            for bone_index, key in enumerate(bone_keys):
+                column = bone_weights[:, bone_index]
+                combined[key] = combined[key] + column if key in combined else column
+            converted_mods.append(lm)
+        return combined, converted_mods
+
+    def write_weights(self, obj, combined):
+        """Writes weight columns to vertex groups and Armature modifiers,
+        returns the modifiers and a function undoing all changes."""
+        created_groups = []
+        prev_weights = {}
+        prev_use_deform = {}
+        prev_mods = set(m.name for m in obj.modifiers)
+        armature_mods = []
+        all_indices = np.arange(len(obj.data.vertices))
+        for (armature, bone_name), column in combined.items():
+            affected = column > 1e-4
+            if not affected.any():
+                continue
+            vg = obj.vertex_groups.get(bone_name, None)
+            if not vg:
+                vg = obj.vertex_groups.new(bone_name)
+                created_groups.append(vg.name)
+            elif vg.name not in prev_weights:
+                prev_weights[vg.name] = get_vertex_group_weights(obj, vg.index)
+            assign_vertex_weights(vg, all_indices[affected],
+                                  np.minimum(column[affected], 1.0))
+            # Armature modifier skips non-deform bones, as Create Hooks makes them
+            bone = armature.data.bones[bone_name]
+            prev_use_deform.setdefault((armature, bone_name), bone.use_deform)
+            bone.use_deform = True
+            am = ensure_armature_modifier(obj, armature)
+            if am not in armature_mods:
+                armature_mods.append(am)
+        created_mods = [am for am in armature_mods if am.name not in prev_mods]
+
+        def undo():
+            for am in created_mods:
+                obj.modifiers.remove(am)
+            for name in created_groups:
+                obj.vertex_groups.remove(obj.vertex_groups[name])
+            for name, weights in prev_weights.items():
+                vg = obj.vertex_groups[name]
+                vg.remove(all_indices.tolist())
+                assign_vertex_weights(vg, all_indices[weights > 0.0], weights[weights > 0.0])
+            for (armature, bone_name), use_deform in prev_use_deform.items():
+                armature.data.bones[bone_name].use_deform = use_deform
+
+        return armature_mods, undo
+
+    def convert_lattices(self, context, obj):
+        """Returns number of lattice modifiers converted, and why the mesh was kept as is, if it was."""
+        lattice_mods = [m for m in obj.modifiers if m.type == 'LATTICE'
+                        and m.show_viewport and m.object]
+        combined, converted_mods = self.get_combined_weights(obj, lattice_mods)
+        if not combined:
+            return 0, None
+
+        # Both results match trivially in rest pose, so they prove nothing
+        if self.is_rest_pose(combined):
+            return 0, "bones in rest pose, pose them to verify the conversion"
+
+        # Weights are fractions of bone displacement, but the Armature
+        # modifier normalizes by total weight: the undriven rest of affected
+        # vertices goes to a bone that stays put, or a lone 0.2 weight would
+        # move fully. Vertices outside the lattices get nothing.
+        armature = next(iter(combined))[0]
+        rest = armature.data.bones.get(self.rest_bone, None)
+        if rest and not rest.use_deform:
+            return 0, "rest bone %s isn't a deform bone" % self.rest_bone
+        self.ensure_rest_bone(context, armature)
+        total = np.sum(list(combined.values()), axis=0)
+        rest_key = (armature, self.rest_bone)
+        rest_column = np.where(total > 0.0, np.clip(1.0 - total, 0.0, 1.0), 0.0)
+        combined[rest_key] = combined[rest_key] + rest_column if rest_key in combined \
+            else rest_column
+
+        # Skin weights already on the armature are normalized along with the
+        # new ones, so compare against lattices and existing skinning together.
+        prev_armature_mods = [m for m in obj.modifiers if m.type == 'ARMATURE'
+                              and m.object == armature and m.show_viewport]
+        lattice_result = get_deformed_coordinates(context.scene, obj,
+                                                  converted_mods + prev_armature_mods)
+        armature_mods, undo = self.write_weights(obj, combined)
+        armature_result = get_deformed_coordinates(context.scene, obj, armature_mods)
+
+        deviation = None
+        if lattice_result is not None and armature_result is not None:
+            deviation = float(np.linalg.norm(armature_result - lattice_result, axis=1).max())
+        if deviation is None:
+            undo()
+            return 0, "topology changed by other modifiers"
+        if deviation > self.tolerance:
+            undo()
+            return 0, "deviation %.5f" % deviation
+
+        # Never leave lattices and armature deforming the mesh both
+        for lm in converted_mods:
+            if self.remove_lattice_modifiers:
+                obj.modifiers.remove(lm)
+            else:
+                lm.show_viewport = False
+                lm.show_render = False
+
+        return len(converted_mods), None
+
+    def execute(self, context):
+        meshes = [obj for obj in context.selected_objects if obj.type == 'MESH']
+        converted = 0
+        kept = []
+        for obj in meshes:
+            count, reason = self.convert_lattices(context, obj)
+            converted += count
+            if reason:
+                kept.append("%s (%s)" % (obj.name, reason))
+
+        self.report({'WARNING'} if kept else {'INFO'},
+                    "%d lattice modifiers converted%s" %
+                    (converted, ", kept as is: " + ", ".join(kept) if kept else ""))
 
         return {'FINISHED'}
 
@@ -244,14 +1629,17 @@ class ADH_MaskSelectedVertices(Operator, ADH_AbstractMaskOperator):
         options={'HIDDEN', 'SKIP_SAVE'})
 
     def invoke(self, context, event):
-        mesh = context.active_object
-        self.save_vg(context)
-
         if event.shift:
             self.action = 'remove'
         elif event.ctrl:
             self.action = 'invert'
 
+        return self.execute(context)
+
+    def execute(self, context):
+        mesh = context.active_object
+        self.save_vg(context)
+
         vg = mesh.vertex_groups.get(self.MASK_NAME)
         if not vg:
             vg = mesh.vertex_groups.new(self.MASK_NAME)
@@ -262,20 +1650,18 @@ class ADH_MaskSelectedVertices(Operator, ADH_AbstractMaskOperator):
 
         self.setup_mask_modifier(context)
 
-        mesh.data.update()
-        selected_verts = [vert.index for vert in mesh.data.vertices
-                          if vert.select == True]
-
+        # Edit mode assignment works on the edit mesh directly, so the
+        # selection is only read (in bulk) in Object mode.
         if self.action == 'add':
             if context.object.mode == 'EDIT':
                 bpy.ops.object.vertex_group_assign()
             else:
-                vg.add(selected_verts, 1.0, 'REPLACE')
+                vg.add(get_selected_vertices(mesh)[0].tolist(), 1.0, 'REPLACE')
         elif self.action == 'remove':
             if context.object.mode == 'EDIT':
                 bpy.ops.object.vertex_group_remove_from()
             else:
-                vg.remove(selected_verts)
+                vg.remove(get_selected_vertices(mesh)[0].tolist())
 
         self.restore_vg(context)
 
@@ -290,9 +1676,8 @@ class ADH_CopyCustomShapes(Operator):
 
     @classmethod
     def poll(self, context):
-        non_armatures_selected = [o.type for o in context.selected_objects
-                                  if o.type != 'ARMATURE']
-        return len(context.selected_objects) >= 2 and not non_armatures_selected
+        facts = get_selection_facts(context)
+        return facts.object_count >= 2 and facts.count('ARMATURE') == facts.object_count
 
     def execute(self, context):
         src_armature = context.active_object
@@ -306,6 +1691,7 @@ class ADH_CopyCustomShapes(Operator):
                         bone.custom_shape
                 except:
                     pass
+        invalidate_widget_index()
 
         return {'FINISHED'}
 
@@ -332,9 +1718,125 @@ class ADH_UseSameCustomShape(Operator):
 
         for bone in context.selected_pose_bones:
             bone.custom_shape = custom_shape
+        invalidate_widget_index()
+
+        return {'FINISHED'}
+
+
+class ADH_CopyConstraints(Operator):
+    """Copies active pose bone's constraint stack to each selected pose bone, remapping bone subtargets."""
+    bl_idname = 'armature.adh_copy_constraints'
+    bl_label = 'Copy Constraints'
+    bl_options = {'REGISTER', 'UNDO'}
+
+    remap = EnumProperty(
+        name='Remap Subtargets',
+        items=[('NAME', 'Bone Name', 'Replace active bone name, as a whole name part, in subtargets ' +
+                'with target bone name, e.g. hook-X becomes hook-Y'),
+               ('SIDE', 'Side Suffix', 'Flip side suffix of subtargets when target bone is on the other side'),
+               ('REGEX', 'Regex', 'Substitute regular expression in subtargets'),
+               ('NONE', 'None', 'Keep subtargets as is')],
+        default='NAME')
+
+    search_pattern = StringProperty(
+        name='Search',
+        description='Regular pattern to match against subtargets. ' +
+                    '"{bone}" stands for active bone name')
+
+    replacement_string = StringProperty(
+        name='Replace',
+        description='String to replace each match. "{bone}" stands for target bone name')
+
+    replace_existing = BoolProperty(
+        name='Replace Existing',
+        description='Remove constraints already on the selected bones',
+        default=False)
+
+    invoked = False
+
+    def remap_subtarget(self, subtarget, source_name, target_name):
+        if self.remap == 'NAME':
+            # Whole name parts only, or "arm" would turn "forearm" into "foreleg"
+            pattern = r'(?<![^._-])%s(?![^._-])' % re.escape(source_name)
+            return re.sub(pattern, lambda match: target_name, subtarget)
+        elif self.remap == 'SIDE':
+            source_side, target_side = get_side(source_name), get_side(target_name)
+            if source_side and target_side and source_side != target_side:
+                return flip_side_suffix(subtarget) or subtarget
+            return subtarget
+        elif self.remap == 'REGEX':
+            pattern = self.search_pattern.replace('{bone}', re.escape(source_name))
+            replacement = self.replacement_string.replace('{bone}', target_name)
+            return re.sub(pattern, replacement, subtarget)
+        return subtarget
+
+    @classmethod
+    def poll(cls, context):
+        return context.active_pose_bone is not None and \
+               context.active_pose_bone.constraints
+
+    def draw(self, context):
+        layout = self.layout
+
+        if self.invoked:
+            return
+
+        row = layout.row(align=True)
+        row.prop(self, "remap", expand=True)
+
+        col = layout.column(align=True)
+        col.active = self.remap == 'REGEX'
+        col.prop(self, "search_pattern")
+        col.prop(self, "replacement_string")
+
+        layout.prop(self, "replace_existing")
+
+    def execute(self, context):
+        source = context.active_pose_bone
+        targets = [pbone for pbone in context.selected_pose_bones if pbone != source]
+        if not targets:
+            return {'CANCELLED'}
+
+        # Settings read once, then written to every target bone
+        stack = [(constraint.name, constraint.type, get_writable_settings(constraint))
+                 for constraint in source.constraints]
+        # Subtargets are resolved within each constraint's target armature
+        bone_indices = {}
+
+        copied = unresolved = 0
+        for pbone in targets:
+            if self.replace_existing:
+                for constraint in list(pbone.constraints):
+                    pbone.constraints.remove(constraint)
+
+            for name, ctype, settings in stack:
+                constraint = pbone.constraints.new(ctype)
+                constraint.name = name
+                for attr, value in settings.items():
+                    if attr in CONSTRAINT_SUBTARGET_ATTRIBUTES and value:
+                        target = settings.get('pole_target' if attr == 'pole_subtarget'
+                                              else 'target', None)
+                        if target is not None and target.type == 'ARMATURE':
+                            if target.name not in bone_indices:
+                                bone_indices[target.name] = set(target.data.bones.keys())
+                            mapped = self.remap_subtarget(value, source.name, pbone.name)
+                            if mapped in bone_indices[target.name]:
+                                value = mapped
+                            elif mapped != value:
+                                unresolved += 1
+                    apply_settings(constraint, {attr: value})
+                copied += 1
+
+        self.report({'INFO'}, "%d constraints copied to %d bones, %d subtargets not found" %
+                    (copied, len(targets), unresolved))
 
         return {'FINISHED'}
 
+    def invoke(self, context, event):
+        retval = context.window_manager.invoke_props_dialog(self)
+        self.invoked = True
+        return retval
+
 
 class ADH_CreateCustomShape(Operator):
     """Creates mesh for custom shape for selected bones, at active bone's position, using its name as suffix."""
@@ -758,6 +2260,7 @@ class ADH_CreateCustomShape(Operator):
 
         for bone in context.selected_pose_bones:
             bone.custom_shape = widget
+        invalidate_widget_index()
 
         return {'FINISHED'}
 
@@ -792,6 +2295,113 @@ class ADH_SelectCustomShape(Operator):
         return {'FINISHED'}
 
 
+class ADH_SelectShapeUsers(Operator):
+    """Selects all bones, in all armatures, using active object (or active bone's custom shape) as custom shape."""
+    bl_idname = 'armature.adh_select_shape_users'
+    bl_label = 'Select Custom Shape Users'
+    bl_options = {'REGISTER', 'UNDO'}
+
+    @classmethod
+    def poll(cls, context):
+        active = context.active_object
+        return active is not None and \
+               (active.type != 'ARMATURE' or context.active_pose_bone is not None and
+                context.active_pose_bone.custom_shape is not None)
+
+    def execute(self, context):
+        scene = context.scene
+        active = context.active_object
+        widget = context.active_pose_bone.custom_shape \
+            if active.type == 'ARMATURE' else active
+        users = [(armature_name, bone_name) for armature_name, bone_name
+                 in get_widget_index().get_users(widget)
+                 if armature_name in bpy.data.objects]
+        if not users:
+            self.report({'INFO'}, "%s isn't used as custom shape" % widget.name)
+            return {'CANCELLED'}
+
+        if active.mode != 'OBJECT' and active.type != 'ARMATURE':
+            bpy.ops.object.mode_set(mode='OBJECT')
+        armature_names = set(armature_name for armature_name, bone_name in users)
+        for armature_name in armature_names:
+            for bone in bpy.data.objects[armature_name].data.bones:
+                bone.select = False
+        for armature_name, bone_name in users:
+            bone = bpy.data.objects[armature_name].data.bones.get(bone_name, None)
+            if bone is None:
+                continue  # Renamed since the index was built
+            bone.select = True
+            bone.select_head = True
+            bone.select_tail = True
+
+        # Bones of the active armature (or the first found) are shown in Pose mode
+        armature = active if active.name in armature_names else \
+            bpy.data.objects[users[0][0]]
+        if armature.name in scene.objects:
+            if active != armature:
+                active.select = False
+                armature.select = True
+                scene.objects.active = armature
+            active_bone_name = [bone_name for armature_name, bone_name in users
+                                if armature_name == armature.name][0]
+            armature.data.bones.active = armature.data.bones.get(active_bone_name, None)
+            if armature.mode != 'POSE':
+                bpy.ops.object.mode_set(mode='POSE')
+
+        self.report({'INFO'}, "%d bones in %d armatures use %s" %
+                    (len(users), len(armature_names), widget.name))
+
+        return {'FINISHED'}
+
+
+class ADH_SelectUnusedShapes(Operator):
+    """Selects widget objects (by name prefix) not used as custom shape by any bone."""
+    bl_idname = 'object.adh_select_unused_shapes'
+    bl_label = 'Select Unused Custom Shapes'
+    bl_options = {'REGISTER', 'UNDO'}
+
+    widget_prefix = StringProperty(
+        name='Prefix',
+        description="Name prefix of widget objects",
+        default='WGT-')
+
+    @classmethod
+    def poll(cls, context):
+        return context.mode == 'OBJECT'
+
+    def execute(self, context):
+        index = get_widget_index()
+        unused = [obj for obj in context.scene.objects
+                  if obj.name.startswith(self.widget_prefix) and not index.is_used(obj)]
+        for obj in context.selected_objects:
+            obj.select = False
+        for obj in unused:
+            obj.select = True
+
+        self.report({'INFO'}, "%d unused custom shapes%s" %
+                    (len(unused), ": " + ", ".join(obj.name for obj in unused) if unused else ""))
+
+        return {'FINISHED'}
+
+
+class ADH_ReportSharedShapes(Operator):
+    """Reports custom shape objects shared by bones of more than one armature."""
+    bl_idname = 'object.adh_report_shared_shapes'
+    bl_label = 'Report Shared Custom Shapes'
+    bl_options = {'REGISTER'}
+
+    def execute(self, context):
+        shared = get_widget_index().get_shared()
+        descriptions = ["%s (%s)" % (widget_name, ", ".join(armature_names))
+                        for widget_name, armature_names in sorted(shared.items())]
+
+        self.report({'WARNING'} if shared else {'INFO'},
+                    "%d custom shapes shared across armatures%s" %
+                    (len(shared), ": " + "; ".join(descriptions) if shared else ""))
+
+        return {'FINISHED'}
+
+
 class ADH_CreateHooks(Operator):
     """Creates parentless bone for each selected bones (local copy-transformed) or lattice points."""
     bl_idname = 'armature.adh_create_hooks'
@@ -806,82 +2416,58 @@ class ADH_CreateHooks(Operator):
         default=[x == 30 for x in range(0, 32)]
     )
 
+    lattice_binding = EnumProperty(
+        name="Lattice Binding",
+        items=[('HOOK', 'Hook Modifiers', 'One Hook modifier for each lattice point'),
+               ('ARMATURE', 'Armature Modifier',
+                'One vertex group for each lattice point, all deformed by a single Armature modifier')],
+        default='HOOK')
+
+    cluster_count = IntProperty(
+        name="Clusters",
+        description="Number of hook bones for selected lattice points, grouped by proximity. " +
+                    "0 creates one bone for each point",
+        min=0, default=0)
+
+    cluster_method = EnumProperty(
+        name="Cluster Method",
+        items=[('KMEANS', 'K-Means', 'Group points around evenly distributed centroids'),
+               ('GRID', 'Grid', 'Group points by cells of a regular grid')],
+        default='KMEANS')
+
+    cluster_overlap = FloatProperty(
+        name="Overlap",
+        description="How far clusters reach beyond their radius, with weights fading by distance. " +
+                    "Used only with Armature Modifier binding",
+        min=0.0, max=2.0, default=0.0)
+
     invoked = False
 
-    def setup_copy_constraint(self, armature, bone_name):
-        bone = armature.pose.bones[bone_name]
-        ct_constraint = bone.constraints.new('COPY_TRANSFORMS')
+    def setup_copy_constraint(self, armature, pbone):
+        ct_constraint = pbone.constraints.new('COPY_TRANSFORMS')
         ct_constraint.owner_space = 'LOCAL'
         ct_constraint.target_space = 'LOCAL'
         ct_constraint.target = armature
-        ct_constraint.subtarget = PRF_HOOK + bone_name
-
-    def hook_on_lattice(self, context, lattice, armature):
-        objects = context.scene.objects
-
-        prev_lattice_mode = lattice.mode
-        bpy.ops.object.mode_set(mode='OBJECT')  # Needed for matrix calculation
-
-        armature_mat_inv = armature.matrix_world.inverted()
-        lattice_mat = lattice.matrix_world
-
-        def global_lat_point_co(p):
-            return armature_mat_inv * (lattice_mat * p)
-
-        def get_selected_points(lat):
-            return [point for point in lat.data.points if point.select]
+        ct_constraint.subtarget = PRF_HOOK + pbone.name
 
-        lattice_pos = get_selected_points(lattice)
-        bone_pos = [global_lat_point_co(point.co) for point in lattice_pos]
-        bone_names = [
-            "%(prefix)s%(lat)s.%(index)d%(suffix)s" %
-            dict(prefix=PRF_HOOK, lat=lattice.name, index=index,
-                 suffix=".R" if global_lat_point_co(point).x < 0 \
-                     else ".L" if point.x > 0 else "")
-            for index, point in enumerate(bone_pos)]
-
-        objects.active = armature
-        prev_mode = armature.mode
-        bpy.ops.object.mode_set(mode='EDIT')
-        for index, point_co in enumerate(bone_pos):
-            bone_name = bone_names[index]
-            bone = armature.data.edit_bones.new(bone_name)
+    def create_lattice_hook_bones(self, edit_bones, armature, bone_names, bone_pos):
+        for index, point_co in enumerate(bone_pos.tolist()):
+            bone = edit_bones.new(bone_names[index])
+            bone_names[index] = bone.name  # Possibly renamed on clash
             bone.head = point_co
-            bone.tail = point_co + Vector([0, 0, BBONE_BASE_SIZE * 5])
+            bone.tail = Vector(point_co) + Vector([0, 0, BBONE_BASE_SIZE * 5])
             bone.bbone_x = BBONE_BASE_SIZE
             bone.bbone_z = BBONE_BASE_SIZE
             bone.layers = self.hook_layers
-            bone.use_deform = False
+            # Armature modifier only uses deform bones, Hook modifiers any bone
+            bone.use_deform = self.lattice_binding == 'ARMATURE'
         armature.data.layers = list(
             map(any, zip(armature.data.layers, self.hook_layers)))
-        bpy.ops.object.mode_set(mode=prev_mode)
-
-        objects.active = lattice
-        bpy.ops.object.mode_set(mode='EDIT')
-        selected_points = get_selected_points(lattice)  # previous one lost after toggling
-        for point in selected_points:
-            point.select = False
-        for index, point in enumerate(selected_points):
-            bone_name = bone_names[index]
-            mod = lattice.modifiers.new(bone_name, 'HOOK')
-            mod.object = armature
-            mod.subtarget = bone_name
-            point.select = True
-            bpy.ops.object.hook_assign(modifier=bone_name)
-            bpy.ops.object.hook_reset(modifier=bone_name)
-            point.select = False
-        for point in selected_points:
-            point.select = True
-        bpy.ops.object.mode_set(mode=prev_lattice_mode)
-
-        return {'FINISHED'}
 
-    def hook_on_bone(self, context, armature):
-        prev_mode = armature.mode
-        bpy.ops.object.mode_set(mode='EDIT')
+    def create_bone_hooks(self, edit_bones, context, bone_names):
         for bone in context.selected_bones:
             hook_name = PRF_HOOK + bone.name
-            hook = armature.data.edit_bones.new(hook_name)
+            hook = edit_bones.new(hook_name)
             hook.head = bone.head
             hook.tail = bone.tail
             hook.bbone_x = bone.bbone_x * 2
@@ -890,10 +2476,101 @@ class ADH_CreateHooks(Operator):
             hook.use_deform = False
             hook.roll = bone.roll
             hook.parent = bone.parent
-        bpy.ops.object.mode_set(mode='POSE')
-        for bone in context.selected_pose_bones:
-            self.setup_copy_constraint(armature, bone.name)
-        bpy.ops.object.mode_set(mode=prev_mode)
+            bone_names.append(bone.name)
+
+    def setup_copy_constraints(self, pose_bones, armature, bone_names):
+        for bone_name in bone_names:
+            self.setup_copy_constraint(armature, pose_bones[bone_name])
+
+    def get_selected_lattice_points(self, lattice):
+        """Returns indices and local coordinates of selected lattice points."""
+        points = lattice.data.points
+        selection = np.zeros(len(points), dtype=bool)
+        points.foreach_get('select', selection)
+        coordinates = np.empty(len(points) * 3, dtype=np.float32)
+        points.foreach_get('co_deform', coordinates)
+        indices = np.flatnonzero(selection)
+        return indices, coordinates.reshape(-1, 3)[indices]
+
+    def cluster_points(self, coordinates):
+        """Returns (bone positions, point labels) for selected points' coordinates."""
+        if 0 < self.cluster_count < len(coordinates):
+            if self.cluster_method == 'GRID':
+                return cluster_points_grid(coordinates, self.cluster_count)
+            return cluster_points_kmeans(coordinates, self.cluster_count)
+        return coordinates, np.arange(len(coordinates))
+
+    def setup_hook_modifiers(self, lattice, armature, bone_names, bone_point_indices, centers):
+        # Same result as hook_assign and hook_reset, without operator calls
+        # nor point selection toggling. Hooks' inverse matrices are computed
+        # all at once: (lattice_world^-1 * armature_world * bone_matrix)^-1
+        bones = armature.data.bones
+        bone_matrices = np.array([bones[name].matrix_local for name in bone_names],
+                                 dtype=np.float64)
+        base_matrix = np.array(lattice.matrix_world.inverted() * armature.matrix_world,
+                               dtype=np.float64)
+        inverse_matrices = np.linalg.inv(np.matmul(base_matrix, bone_matrices))
+
+        for bone_name, point_indices, center, matrix_inverse in zip(
+                bone_names, bone_point_indices, centers.tolist(),
+                inverse_matrices.tolist()):
+            mod = lattice.modifiers.new(bone_name, 'HOOK')
+            mod.object = armature
+            mod.subtarget = bone_name
+            mod.vertex_indices_set(point_indices.tolist())
+            mod.center = center
+            mod.matrix_inverse = Matrix(matrix_inverse)
+
+    def hook_on_lattice(self, context, lattice, armature):
+        prev_lattice_mode = lattice.mode
+        bpy.ops.object.mode_set(mode='OBJECT')  # Needed for matrix calculation
+
+        point_indices, point_coordinates = self.get_selected_lattice_points(lattice)
+        if not len(point_indices):
+            bpy.ops.object.mode_set(mode=prev_lattice_mode)
+            return {'CANCELLED'}
+
+        # Clustering is done in armature space, where bones are created
+        matrix = armature.matrix_world.inverted() * lattice.matrix_world
+        point_pos = transform_coordinates(matrix, point_coordinates)
+        bone_pos, labels = self.cluster_points(point_pos)
+        bone_names = [
+            "%(prefix)s%(lat)s.%(index)d%(suffix)s" %
+            dict(prefix=PRF_HOOK, lat=lattice.name, index=index,
+                 suffix=".R" if point[0] < 0 else ".L" if point[0] > 0 else "")
+            for index, point in enumerate(bone_pos.tolist())]
+
+        batch = ADH_ArmatureModeBatch(context, armature)
+        batch.add_edit_task(self.create_lattice_hook_bones, armature,
+                            bone_names, bone_pos)
+        timings = batch.run()  # Lattice is active again afterwards
+
+        if self.lattice_binding == 'ARMATURE':
+            weights = get_cluster_weights(point_pos, bone_pos, labels,
+                                          self.cluster_overlap)
+            bind_points_to_bones(lattice, armature, bone_names, point_indices,
+                                 weights)
+        else:
+            order = np.argsort(labels, kind='mergesort')
+            splits = np.cumsum(np.bincount(labels))[:-1]
+            bone_point_indices = np.split(point_indices[order], splits)
+            centers = transform_coordinates(matrix.inverted(), bone_pos)
+            self.setup_hook_modifiers(lattice, armature, bone_names,
+                                      bone_point_indices, centers)
+        bpy.ops.object.mode_set(mode=prev_lattice_mode)
+
+        report_batch_timings(self, len(bone_names), timings)
+
+        return {'FINISHED'}
+
+    def hook_on_bone(self, context, armature):
+        bone_names = []  # Filled during edit phase, used in pose phase
+        batch = ADH_ArmatureModeBatch(context, armature)
+        batch.add_edit_task(self.create_bone_hooks, context, bone_names)
+        batch.add_pose_task(self.setup_copy_constraints, armature, bone_names)
+        timings = batch.run()
+
+        report_batch_timings(self, len(bone_names), timings)
 
         return {'FINISHED'}
 
@@ -911,6 +2588,14 @@ class ADH_CreateHooks(Operator):
         row = layout.row(align=True)
         row.prop(self, "hook_layers")
 
+        row = layout.row(align=True)
+        row.prop(self, "lattice_binding", expand=True)
+
+        row = layout.row(align=True)
+        row.prop(self, "cluster_count")
+        row.prop(self, "cluster_method", text="")
+        row.prop(self, "cluster_overlap")
+
     def execute(self, context):
         obj1 = context.active_object
         if obj1.type == 'LATTICE':
@@ -928,6 +2613,62 @@ class ADH_CreateHooks(Operator):
         return retval
 
 
+class ADH_ConvertHooksToArmature(Operator):
+    """Replaces bone Hook modifiers of selected lattices with vertex groups and a single Armature modifier."""
+    bl_idname = 'lattice.adh_convert_hooks_to_armature'
+    bl_label = 'Convert Hooks to Armature'
+    bl_options = {'REGISTER', 'UNDO'}
+
+    @classmethod
+    def poll(cls, context):
+        return context.mode == 'OBJECT' \
+               and get_selection_facts(context).count('LATTICE') > 0
+
+    def get_convertible_hooks(self, lattice):
+        """Returns bone Hook modifiers that deform the same way through an Armature modifier.
+
+        Only hooks reset at their bone's rest pose qualify, which is how
+        Create Hooks sets them. The Armature modifier normalizes by total
+        weight, so partial strength, falloff, or points shared by several
+        hooks wouldn't be kept; such hooks are left as they are."""
+        hook_mods = [m for m in lattice.modifiers if m.type == 'HOOK'
+                     and m.object and m.object.type == 'ARMATURE' and m.subtarget
+                     and m.subtarget in m.object.data.bones
+                     and m.strength == 1.0 and m.falloff_type == 'NONE'
+                     and not m.vertex_group]
+        point_users = np.zeros(len(lattice.data.points), dtype=np.int32)
+        for mod in hook_mods:
+            np.add.at(point_users, list(mod.vertex_indices), 1)
+        return [mod for mod in hook_mods
+                if not (point_users[list(mod.vertex_indices)] > 1).any()]
+
+    def convert_hooks(self, lattice):
+        hook_mods = self.get_convertible_hooks(lattice)
+        for mod in hook_mods:
+            vg = lattice.vertex_groups.get(mod.subtarget, None)
+            if not vg:
+                vg = lattice.vertex_groups.new(mod.subtarget)
+            vg.add(list(mod.vertex_indices), 1.0, 'REPLACE')
+            # Armature modifier skips non-deform bones, as Create Hooks makes them
+            mod.object.data.bones[mod.subtarget].use_deform = True
+            ensure_armature_modifier(lattice, mod.object)
+
+        for mod in hook_mods:
+            lattice.modifiers.remove(mod)
+
+        return len(hook_mods)
+
+    def execute(self, context):
+        lattices = [obj for obj in context.selected_objects if obj.type == 'LATTICE']
+        hook_count = sum(1 for lattice in lattices for m in lattice.modifiers
+                         if m.type == 'HOOK')
+        converted = sum(self.convert_hooks(lattice) for lattice in lattices)
+        self.report({'INFO'}, "%d hooks converted, %d kept (partial strength, falloff, "
+                              "vertex group or shared points)" % (converted, hook_count - converted))
+
+        return {'FINISHED'}
+
+
 class ADH_CreateSpokes(Operator):
     """Creates parentless bones in selected armature from the 3D cursor, ending at each selected vertices of active mesh object."""
     bl_idname = 'armature.adh_create_spokes'
@@ -1006,26 +2747,52 @@ class ADH_CreateSpokes(Operator):
         tip_bone.layers = self.aux_layers
         tip_bone.use_deform = False
 
-    def setup_bone_constraint(self, armature, bone_name):
+    def setup_bone_constraint(self, armature, pbone):
         if not self.tip:
             return
-        pbone = armature.pose.bones[bone_name]
-        tip_name = PRF_TIP + bone_name
+        tip_name = PRF_TIP + pbone.name
         dt_constraint = pbone.constraints.new('DAMPED_TRACK')
         dt_constraint.target = armature
         dt_constraint.subtarget = tip_name
 
-    def setup_bone(self, armature, bone_name, head_co, tail_co, parent):
-        bone = armature.data.edit_bones.new(bone_name)
-        bone.head = head_co
-        bone.tail = tail_co
-        bone.bbone_x = BBONE_BASE_SIZE
-        bone.bbone_z = BBONE_BASE_SIZE
-        bone.use_deform = True
-        bone.select = True
-        bone.layers = self.spoke_layers
-        self.setup_bone_parent(armature, bone, parent)
-        self.setup_bone_tip(armature, bone)
+    def setup_bones(self, edit_bones, bone_names, head_co, tail_coordinates, parent):
+        """Creates spoke bones (and their tips) in a batch, returns their actual names."""
+        count = len(bone_names)
+        heads = np.tile(np.array(head_co, dtype=np.float32), (count, 1))
+        tails = np.asarray(tail_coordinates, dtype=np.float32)
+
+        bones = [edit_bones.new(bone_name) for bone_name in bone_names]
+        set_collection_tail(edit_bones, 'head', heads)
+        set_collection_tail(edit_bones, 'tail', tails)
+        set_collection_tail(edit_bones, 'bbone_x', np.full(count, BBONE_BASE_SIZE))
+        set_collection_tail(edit_bones, 'bbone_z', np.full(count, BBONE_BASE_SIZE))
+        set_collection_tail(edit_bones, 'use_deform', np.ones(count), dtype=bool)
+        set_collection_tail(edit_bones, 'select', np.ones(count), dtype=bool)
+        set_collection_tail(edit_bones, 'layers',
+                            np.tile(list(self.spoke_layers), (count, 1)), dtype=bool)
+        bone_names = [bone.name for bone in bones]  # Possibly renamed on clash
+
+        if parent:
+            for bone in bones:
+                bone.parent = parent
+                bone.use_connect = True
+
+        if self.tip:
+            directions = tails - heads
+            lengths = np.linalg.norm(directions, axis=1)[:, np.newaxis]
+            directions /= np.maximum(lengths, 1e-12)
+
+            for bone_name in bone_names:
+                edit_bones.new(PRF_TIP + bone_name)
+            set_collection_tail(edit_bones, 'head', tails)
+            set_collection_tail(edit_bones, 'tail', tails + directions * .05)
+            set_collection_tail(edit_bones, 'bbone_x', np.full(count, BBONE_BASE_SIZE * 2))
+            set_collection_tail(edit_bones, 'bbone_z', np.full(count, BBONE_BASE_SIZE * 2))
+            set_collection_tail(edit_bones, 'use_deform', np.zeros(count), dtype=bool)
+            set_collection_tail(edit_bones, 'layers',
+                                np.tile(list(self.aux_layers), (count, 1)), dtype=bool)
+
+        return bone_names
 
     def set_armature_layers(self, armature):
         combined_layers = list(
@@ -1036,60 +2803,70 @@ class ADH_CreateSpokes(Operator):
         armature.data.layers = combined_layers
 
     def get_vertex_coordinates(self, mesh, armature):
-        # Get vertex coordinates localized to armature's matrix
-        mesh.update_from_editmode()
-        armature_mat_inv = armature.matrix_world.inverted()
-        mesh_mat = mesh.matrix_world
-        return [armature_mat_inv * (mesh_mat * vert.co)
-                for vert in mesh.data.vertices if vert.select]
+        # Get selected vertex coordinates localized to armature's matrix,
+        # read from the edit mesh and transformed in one pass.
+        coordinates = get_selected_vertices(mesh)[1]
+        matrix = armature.matrix_world.inverted() * mesh.matrix_world
+        return transform_coordinates(matrix, coordinates)
 
     def create_spokes(self, context, mesh, armature):
         scene = context.scene
 
         vert_coordinates = self.get_vertex_coordinates(mesh, armature)
         cursor_co = armature.matrix_world.inverted() * scene.cursor_location
+        if not len(vert_coordinates):
+            return {'CANCELLED'}
 
         bpy.ops.object.editmode_toggle()
         scene.objects.active = armature
-        prev_mode = armature.mode
 
-        bpy.ops.object.mode_set(mode='EDIT')
+        bone_names = ["%s.%d" % (self.basename, index)
+                      for index in range(len(vert_coordinates))]
+        batch = ADH_ArmatureModeBatch(context, armature)
+        batch.add_edit_task(self.create_spoke_bones, context, bone_names,
+                            cursor_co, vert_coordinates)
+        if self.tip:
+            batch.add_pose_task(self.setup_bone_constraints, armature, bone_names)
+        timings = batch.run()
+
+        self.set_armature_layers(armature)
+        report_batch_timings(self, len(bone_names), timings)
+
+        return {'FINISHED'}
+
+    def create_spoke_bones(self, edit_bones, context, bone_names, cursor_co, vert_coordinates):
         for bone in context.selected_editable_bones:
             bone.select = False
 
         parent = None
         if self.parent:
-            parent = armature.data.edit_bones.new(PRF_ROOT + self.basename)
+            parent = edit_bones.new(PRF_ROOT + self.basename)
             parent.head = cursor_co + Vector([0, 0, -1])
             parent.tail = cursor_co
-        for index, vert_co in enumerate(vert_coordinates):
-            bone_name = "%s.%d" % (self.basename, index)
-            self.setup_bone(armature, bone_name, cursor_co, vert_co, parent)
-
-        bpy.ops.object.mode_set(mode='POSE')
-        for index in range(len(vert_coordinates)):
-            bone_name = "%s.%d" % (self.basename, index)
-            self.setup_bone_constraint(armature, bone_name)
-        bpy.ops.object.mode_set(mode=prev_mode)
-
-        self.set_armature_layers(armature)
-
-        return {'FINISHED'}
-
-    def create_spoke_tips(self, context, armature):
-        prev_mode = armature.mode
+        # Replaced in place, so the pose phase sees names changed on clash
+        bone_names[:] = self.setup_bones(edit_bones, bone_names, cursor_co,
+                                         vert_coordinates, parent)
 
-        bpy.ops.object.mode_set(mode='EDIT')
+    def create_bone_tips(self, edit_bones, armature, context, bone_names):
         for bone in context.selected_bones:
             self.setup_bone_parent(armature, bone, None)
             self.setup_bone_tip(armature, bone)
+            bone_names.append(bone.name)
 
-        bpy.ops.object.mode_set(mode='POSE')
-        for bone in context.selected_pose_bones:
-            self.setup_bone_constraint(armature, bone.name)
-        bpy.ops.object.mode_set(mode=prev_mode)
+    def setup_bone_constraints(self, pose_bones, armature, bone_names):
+        for bone_name in bone_names:
+            self.setup_bone_constraint(armature, pose_bones[bone_name])
+
+    def create_spoke_tips(self, context, armature):
+        bone_names = []  # Filled during edit phase, used in pose phase
+        batch = ADH_ArmatureModeBatch(context, armature)
+        batch.add_edit_task(self.create_bone_tips, armature, context, bone_names)
+        if self.tip:
+            batch.add_pose_task(self.setup_bone_constraints, armature, bone_names)
+        timings = batch.run()
 
         self.set_armature_layers(armature)
+        report_batch_timings(self, len(bone_names), timings)
 
         return {'FINISHED'}
 
@@ -1098,7 +2875,7 @@ class ADH_CreateSpokes(Operator):
         active = context.active_object
         return active is not None and active.mode in ['EDIT', 'POSE'] and \
                active.type in ['MESH', 'ARMATURE'] and \
-               len(context.selected_objects) <= 2
+               get_selection_facts(context).object_count <= 2
 
     def draw(self, context):
         layout = self.layout
@@ -1138,13 +2915,425 @@ class ADH_CreateSpokes(Operator):
         return retval
 
 
-class ADH_CreateBoneGroup(Operator):
-    """Creates a new bone group named after active bone, consisting of all selected bones."""
-    bl_idname = 'armature.adh_create_bone_group'
-    bl_label = 'Create Bone Group'
+class ADH_BakeConstraints(Operator):
+    """Bakes visual transform of selected pose bones over a frame range into their action, muting baked constraints."""
+    bl_idname = 'armature.adh_bake_constraints'
+    bl_label = 'Bake Constraints'
     bl_options = {'REGISTER', 'UNDO'}
 
-    @staticmethod
+    constraint_types = EnumProperty(
+        name='Constraint Types',
+        description='Constraints to bake and mute',
+        items=[('DAMPED_TRACK', 'Damped Track', 'Spoke tip constraints'),
+               ('COPY_TRANSFORMS', 'Copy Transforms', 'Hook constraints')],
+        default={'DAMPED_TRACK', 'COPY_TRANSFORMS'},
+        options={'ENUM_FLAG'})
+
+    frame_start = IntProperty(
+        name='Start Frame',
+        description='First frame baked. Defaults to scene start if bigger than end frame',
+        default=1)
+
+    frame_end = IntProperty(
+        name='End Frame',
+        description='Last frame baked',
+        default=0)
+
+    invoked = False
+
+    def get_baked_bones(self, context):
+        return [(pbone, [c for c in pbone.constraints
+                         if c.type in self.constraint_types and not c.mute])
+                for pbone in context.selected_pose_bones or []]
+
+    @staticmethod
+    def get_channels(pbone, matrix, prev_rotation):
+        """Returns (data path, values) for each transform channel of the bone's local matrix."""
+        location, rotation, scale = matrix.decompose()
+        if pbone.rotation_mode == 'QUATERNION':
+            if prev_rotation is not None and rotation.dot(prev_rotation) < 0:
+                rotation.negate()  # Keep interpolation along the short arc
+            rotation_channel = ('rotation_quaternion', rotation)
+        elif pbone.rotation_mode == 'AXIS_ANGLE':
+            axis, angle = rotation.to_axis_angle()
+            rotation_channel = ('rotation_axis_angle', [angle] + list(axis))
+        else:
+            euler = matrix.to_euler(pbone.rotation_mode, prev_rotation) \
+                if prev_rotation is not None else matrix.to_euler(pbone.rotation_mode)
+            rotation_channel = ('rotation_euler', euler)
+        return [('location', location), rotation_channel, ('scale', scale)]
+
+    @classmethod
+    def poll(cls, context):
+        active = context.active_object
+        return active is not None and active.type == 'ARMATURE' and \
+               active.mode == 'POSE' and get_selection_facts(context).pose_bone_count
+
+    def draw(self, context):
+        layout = self.layout
+
+        if self.invoked:
+            return
+
+        row = layout.row(align=True)
+        row.prop(self, "constraint_types")
+
+        row = layout.row(align=True)
+        row.prop(self, "frame_start")
+        row.prop(self, "frame_end")
+
+    def execute(self, context):
+        scene = context.scene
+        armature = context.active_object
+        baked_bones = [(pbone, constraints) for pbone, constraints
+                       in self.get_baked_bones(context) if constraints]
+        if not baked_bones:
+            return {'CANCELLED'}
+
+        frame_start, frame_end = self.frame_start, self.frame_end
+        if frame_start > frame_end:
+            frame_start, frame_end = scene.frame_start, scene.frame_end
+        frames = list(range(frame_start, frame_end + 1))
+        prev_frame = scene.frame_current
+
+        # Sample every frame first, scene evaluation being the only real cost
+        samples = [[] for _ in baked_bones]
+        prev_rotations = [None] * len(baked_bones)
+        start = time.perf_counter()
+        for frame in frames:
+            scene.frame_set(frame)
+            for index, (pbone, constraints) in enumerate(baked_bones):
+                matrix = armature.convert_space(pose_bone=pbone, matrix=pbone.matrix,
+                                                from_space='POSE', to_space='LOCAL')
+                channels = self.get_channels(pbone, matrix, prev_rotations[index])
+                prev_rotations[index] = channels[1][1] if pbone.rotation_mode != 'AXIS_ANGLE' else None
+                samples[index].append([list(values) for path, values in channels])
+        sample_time = time.perf_counter() - start
+
+        anim_data = armature.animation_data or armature.animation_data_create()
+        if not anim_data.action:
+            anim_data.action = bpy.data.actions.new(armature.name + 'Action')
+        action = anim_data.action
+
+        start = time.perf_counter()
+        for (pbone, constraints), bone_samples in zip(baked_bones, samples):
+            channel_paths = [path for path, values in
+                             self.get_channels(pbone, Matrix(), None)]
+            for channel_index, path in enumerate(channel_paths):
+                values = np.array([sample[channel_index] for sample in bone_samples],
+                                  dtype=np.float32)
+                data_path = 'pose.bones["%s"].%s' % (pbone.name, path)
+                for array_index in range(values.shape[1]):
+                    write_fcurve_keyframes(action, data_path, array_index, pbone.name,
+                                           frames, values[:, array_index])
+
+            # Remembered so the bake can be reverted without touching user-muted ones
+            baked_names = set(pbone.get('adh_baked_constraints', []))
+            baked_names.update(c.name for c in constraints)
+            pbone['adh_baked_constraints'] = sorted(baked_names)
+            for constraint in constraints:
+                constraint.mute = True
+        write_time = time.perf_counter() - start
+        scene.frame_set(prev_frame)
+
+        self.report({'INFO'}, "%d bones, %d frames baked: evaluation %.3fs, keyframes %.3fs" %
+                    (len(baked_bones), len(frames), sample_time, write_time))
+
+        return {'FINISHED'}
+
+    def invoke(self, context, event):
+        self.frame_start = context.scene.frame_start
+        self.frame_end = context.scene.frame_end
+        retval = context.window_manager.invoke_props_dialog(self)
+        self.invoked = True
+        return retval
+
+
+class ADH_UnbakeConstraints(Operator):
+    """Unmutes constraints of selected pose bones previously muted by Bake Constraints. Baked keyframes are kept."""
+    bl_idname = 'armature.adh_unbake_constraints'
+    bl_label = 'Unbake Constraints'
+    bl_options = {'REGISTER', 'UNDO'}
+
+    @classmethod
+    def poll(cls, context):
+        active = context.active_object
+        return active is not None and active.type == 'ARMATURE' and \
+               active.mode == 'POSE' and get_selection_facts(context).pose_bone_count
+
+    def execute(self, context):
+        count = 0
+        for pbone in context.selected_pose_bones:
+            baked_names = pbone.get('adh_baked_constraints', None)
+            if baked_names is None:
+                continue
+            for name in baked_names:
+                constraint = pbone.constraints.get(name, None)
+                if constraint:
+                    constraint.mute = False
+                    count += 1
+            del pbone['adh_baked_constraints']
+
+        self.report({'INFO'}, "%d constraints restored" % count)
+
+        return {'FINISHED'}
+
+
+class ADH_PruneDeadConstraints(Operator):
+    """Removes constraints and modifiers that have no effect: muted, zero influence, or missing targets."""
+    bl_idname = 'object.adh_prune_dead_constraints'
+    bl_label = 'Prune Dead Constraints'
+    bl_options = {'REGISTER', 'UNDO'}
+
+    scope = EnumProperty(
+        name='Scope',
+        items=[('SELECTED', 'Selected', 'Selected objects, or selected pose bones in Pose mode'),
+               ('FILE', 'File', 'All objects in the file')],
+        default='SELECTED')
+
+    include_muted = BoolProperty(
+        name='Include Muted',
+        description='Also remove muted constraints and modifiers disabled in viewport and render',
+        default=True)
+
+    dry_run = BoolProperty(
+        name='Dry Run',
+        description='Only report what would be removed',
+        default=False)
+
+    def has_bone(self, armature, bone_name):
+        if armature.name not in self.bone_names:
+            self.bone_names[armature.name] = set(armature.data.bones.keys())
+        return bone_name in self.bone_names[armature.name]
+
+    def has_vertex_group(self, obj, group_name):
+        vg = obj.vertex_groups.get(group_name, None)
+        if vg is None:
+            return False
+        if obj.name not in self.used_groups:
+            elements = obj.data.vertices if obj.type == 'MESH' else \
+                obj.data.points if obj.type == 'LATTICE' else []
+            self.used_groups[obj.name] = set(g.group for element in elements
+                                             for g in element.groups if g.weight > 0.0)
+        return vg.index in self.used_groups[obj.name]
+
+    def get_animated_paths(self, datablock):
+        """Returns data paths with F-curves or drivers (e.g. IK/FK switches) on a datablock."""
+        if datablock.name not in self.animated_paths:
+            paths = set()
+            animation_data = datablock.animation_data
+            if animation_data:
+                actions = [animation_data.action] + \
+                          [strip.action for track in animation_data.nla_tracks
+                           for strip in track.strips]
+                for fc in [fc for action in actions if action for fc in action.fcurves] + \
+                        list(animation_data.drivers):
+                    paths.add(fc.data_path)
+            self.animated_paths[datablock.name] = paths
+        return self.animated_paths[datablock.name]
+
+    def is_animated(self, item):
+        """Returns whether the item's on/off or amount settings change over time."""
+        paths = self.get_animated_paths(item.id_data)
+        return any(item.path_from_id(attr) in paths
+                   for attr in ('mute', 'influence', 'strength', 'show_viewport', 'show_render')
+                   if hasattr(item, attr))
+
+    def get_constraint_fault(self, constraint, pbone):
+        if self.is_animated(constraint):
+            return None
+        # Muted by Bake Constraints, to be unmuted by Unbake Constraints
+        if pbone and constraint.name in pbone.get('adh_baked_constraints', []):
+            return None
+        if self.include_muted and constraint.mute:
+            return 'muted'
+        if constraint.influence == 0.0:
+            return 'zero influence'
+        for target_attr, subtarget_attr in (('target', 'subtarget'),
+                                            ('pole_target', 'pole_subtarget')):
+            target = getattr(constraint, target_attr, None)
+            subtarget = getattr(constraint, subtarget_attr, '')
+            if target and target.type == 'ARMATURE' and subtarget and \
+                    not self.has_bone(target, subtarget):
+                return 'missing %s %s' % (subtarget_attr, subtarget)
+        if not constraint.is_valid:
+            return 'missing target'
+        return None
+
+    def get_modifier_fault(self, obj, mod):
+        if self.is_animated(mod):
+            return None
+        if self.include_muted and not (mod.show_viewport or mod.show_render):
+            return 'disabled'
+        object_attr = MODIFIER_OBJECT_ATTRIBUTES.get(mod.type, None)
+        if object_attr is None:
+            return None
+        target = getattr(mod, object_attr)
+        if target is None:
+            return 'missing %s' % object_attr
+        if getattr(mod, 'strength', None) == 0.0:
+            return 'zero strength'
+        subtarget = getattr(mod, 'subtarget', '')
+        if subtarget and target.type == 'ARMATURE' and not self.has_bone(target, subtarget):
+            return 'missing subtarget %s' % subtarget
+        group_name = getattr(mod, 'vertex_group', '')
+        if group_name and not getattr(mod, 'invert_vertex_group', False) and \
+                not self.has_vertex_group(obj, group_name):
+            return 'empty vertex group %s' % group_name
+        return None
+
+    def get_owners(self, context):
+        """Returns objects whose modifiers are examined, and (object, pose bone or None) constraint owners."""
+        if self.scope == 'SELECTED' and context.mode == 'POSE':
+            return [], [(pbone.id_data, pbone) for pbone in context.selected_pose_bones or []]
+        objects = bpy.data.objects if self.scope == 'FILE' else context.selected_objects
+        owners = []
+        for obj in objects:
+            owners.append((obj, None))
+            if obj.pose:
+                owners.extend((obj, pbone) for pbone in obj.pose.bones)
+        return objects, owners
+
+    def get_dead_items(self, context):
+        """Returns (object, pose bone or None, collection, item, fault) for each dead item."""
+        self.bone_names = {}  # Armature name -> set of bone names
+        self.used_groups = {}  # Object name -> indices of non-empty vertex groups
+        self.animated_paths = {}  # Object name -> animated or driven data paths
+
+        objects, owners = self.get_owners(context)
+        dead_items = []
+        for obj, pbone in owners:
+            constraints = (pbone or obj).constraints
+            for constraint in constraints:
+                fault = self.get_constraint_fault(constraint, pbone)
+                if fault:
+                    dead_items.append((obj, pbone, constraints, constraint, fault))
+        for obj in objects:
+            for mod in obj.modifiers:
+                fault = self.get_modifier_fault(obj, mod)
+                if fault:
+                    dead_items.append((obj, None, obj.modifiers, mod, fault))
+        return dead_items
+
+    def execute(self, context):
+        dead_items = self.get_dead_items(context)
+
+        entries = []
+        descriptions = []
+        for obj, pbone, collection, item, fault in dead_items:
+            descriptions.append("%s%s: %s (%s)" % (obj.name, ' / ' + pbone.name if pbone else '',
+                                                   item.name, fault))
+            entries.append(dict(
+                kind='MODIFIER' if isinstance(item, bpy.types.Modifier) else 'CONSTRAINT',
+                object=obj.name, bone=pbone.name if pbone else None,
+                type=item.type, name=item.name, fault=fault,
+                index=list(collection).index(item),
+                settings=OrderedDict((attr, serialize_setting(value)) for attr, value
+                                     in get_writable_settings(item).items())))
+
+        if self.dry_run or not dead_items:
+            self.report({'INFO'}, "%d dead constraints and modifiers found%s" %
+                        (len(dead_items), ": " + "; ".join(descriptions) if descriptions else ""))
+            return {'FINISHED'}
+
+        for obj, pbone, collection, item, fault in dead_items:
+            collection.remove(item)
+
+        # Each run is appended as one batch, restorable with Restore Pruned
+        journal = bpy.data.texts.get(PRUNE_JOURNAL_NAME, None) or \
+            bpy.data.texts.new(PRUNE_JOURNAL_NAME)
+        batches = json.loads(journal.as_string() or '[]')
+        batches.append(entries)
+        journal.from_string(json.dumps(batches, indent=1))
+
+        self.report({'INFO'}, "%d dead constraints and modifiers removed: %s" %
+                    (len(dead_items), "; ".join(descriptions)))
+
+        return {'FINISHED'}
+
+
+class ADH_RestorePruned(Operator):
+    """Recreates constraints and modifiers removed by the last Prune Dead Constraints run, at their stack positions."""
+    bl_idname = 'object.adh_restore_pruned'
+    bl_label = 'Restore Pruned'
+    bl_options = {'REGISTER', 'UNDO'}
+
+    @classmethod
+    def poll(cls, context):
+        journal = bpy.data.texts.get(PRUNE_JOURNAL_NAME, None)
+        return journal is not None and journal.as_string().strip() not in ('', '[]')
+
+    @staticmethod
+    def move_to_index(obj, pbone, item, index):
+        """Moves a constraint or modifier up from the end of its stack until it's at index,
+        so the stack evaluates in the original order."""
+        prev_active = obj.data.bones.active if pbone else None
+        if isinstance(item, bpy.types.Modifier):
+            steps = len(obj.modifiers) - 1 - index
+            move_up = functools.partial(bpy.ops.object.modifier_move_up,
+                                        {'object': obj, 'modifier': item}, modifier=item.name)
+        else:
+            steps = len((pbone or obj).constraints) - 1 - index
+            move_up = functools.partial(bpy.ops.constraint.move_up,
+                                        {'object': obj, 'constraint': item},
+                                        constraint=item.name,
+                                        owner='BONE' if pbone else 'OBJECT')
+            if pbone:
+                # Bone constraints are looked up on the active bone
+                obj.data.bones.active = pbone.bone
+        for _ in range(steps):
+            try:
+                if move_up() != {'FINISHED'}:
+                    break
+            except RuntimeError:
+                break  # Stack rules keep it from going further, e.g. above the first deform modifier
+        if pbone:
+            obj.data.bones.active = prev_active
+
+    def execute(self, context):
+        journal = bpy.data.texts[PRUNE_JOURNAL_NAME]
+        batches = json.loads(journal.as_string())
+        entries = batches.pop()
+
+        # Reinserting in increasing index order rebuilds each stack's order
+        entries.sort(key=lambda entry: entry.get('index', float('inf')))
+
+        restored = 0
+        for entry in entries:
+            obj = bpy.data.objects.get(entry['object'], None)
+            if obj is None:
+                continue
+            pbone = None
+            if entry['kind'] == 'MODIFIER':
+                item = obj.modifiers.new(entry['name'], entry['type'])
+            else:
+                pbone = obj.pose.bones.get(entry['bone'], None) \
+                    if entry['bone'] and obj.pose else None
+                if entry['bone'] and pbone is None:
+                    continue
+                owner = pbone or obj
+                item = owner.constraints.new(entry['type'])
+                item.name = entry['name']
+            apply_settings(item, OrderedDict((attr, deserialize_setting(value)) for attr, value
+                                             in entry['settings'].items()))
+            if 'index' in entry:
+                self.move_to_index(obj, pbone, item, entry['index'])
+            restored += 1
+
+        journal.from_string(json.dumps(batches, indent=1))
+        self.report({'INFO'}, "%d of %d constraints and modifiers restored" %
+                    (restored, len(entries)))
+
+        return {'FINISHED'}
+
+
+class ADH_CreateBoneGroup(Operator):
+    """Creates a new bone group named after active bone, consisting of all selected bones."""
+    bl_idname = 'armature.adh_create_bone_group'
+    bl_label = 'Create Bone Group'
+    bl_options = {'REGISTER', 'UNDO'}
+
+    @staticmethod
     def random_theme():
         themes = ['THEME01', 'THEME02', 'THEME03', 'THEME04', 'THEME05',
                   'THEME06', 'THEME07', 'THEME08', 'THEME09', 'THEME10',
@@ -1181,7 +3370,7 @@ class ADH_RemoveVertexGroupsUnselectedBones(Operator):
     @classmethod
     def poll(self, context):
         return context.active_object != None \
-               and context.selected_pose_bones != None
+               and get_selection_facts(context).pose_bone_count != None
 
     def execute(self, context):
         bone_names = [b.name for b in context.selected_pose_bones]
@@ -1216,7 +3405,7 @@ class ADH_BindToBone(Operator):
 
     @classmethod
     def poll(cls, context):
-        return len(context.selected_objects) >= 2 and \
+        return get_selection_facts(context).object_count >= 2 and \
                context.active_pose_bone is not None
 
     def execute(self, context):
@@ -1224,16 +3413,12 @@ class ADH_BindToBone(Operator):
         armature = context.active_object
         bone = context.active_pose_bone
         for mesh in meshes:
-            armature_mods = [m for m in mesh.modifiers
-                             if m.type == 'ARMATURE' and m.object == armature]
-            if not armature_mods:
-                am = mesh.modifiers.new('Armature', 'ARMATURE')
-                am.object = armature
+            ensure_armature_modifier(mesh, armature)
 
             if self.set_as_parent:
                 mesh.parent = armature
 
-            vertex_indices = [v.index for v in mesh.data.vertices if v.select] \
+            vertex_indices = get_selected_vertices(mesh)[0].tolist() \
                 if self.only_selected else range(len(mesh.data.vertices))
             vg = mesh.vertex_groups.get(bone.name, None)
             for other_vg in mesh.vertex_groups:
@@ -1251,6 +3436,76 @@ class ADH_BindToBone(Operator):
         return self.execute(context)
 
 
+class ADH_TransferWeights(Operator):
+    """Transfers vertex group weights from active mesh to all other selected meshes, using nearest source vertices."""
+    bl_idname = 'object.adh_transfer_weights'
+    bl_label = 'Transfer Weights'
+    bl_options = {'REGISTER', 'UNDO'}
+
+    method = EnumProperty(
+        name='Method',
+        items=[('NEAREST', 'Nearest', 'Copy weights of the nearest source vertex'),
+               ('BLEND', 'Blend', 'Blend weights of k-nearest source vertices by inverse distance')],
+        default='NEAREST')
+
+    neighbors = IntProperty(
+        name='Neighbors',
+        description="Number of source vertices blended for each target vertex.",
+        min=2, max=16, default=4)
+
+    @classmethod
+    def poll(cls, context):
+        return context.mode == 'OBJECT' \
+               and context.active_object is not None \
+               and context.active_object.type == 'MESH' \
+               and get_selection_facts(context).object_count >= 2
+
+    def transfer_weights(self, tree, source_weights, group_names, target):
+        coordinates = get_vertex_coordinates(target)
+        vert_count = len(coordinates)
+        count = self.neighbors if self.method == 'BLEND' else 1
+
+        nearest = np.zeros((vert_count, count), dtype=np.int32)
+        factors = np.zeros((vert_count, count), dtype=np.float32)
+        for index, co in enumerate(coordinates.tolist()):
+            found = tree.find_n(co, count)
+            for n, (found_co, found_index, dist) in enumerate(found):
+                nearest[index, n] = found_index
+                factors[index, n] = 1.0 / max(dist, 1e-6)
+        factors /= np.maximum(factors.sum(axis=1, keepdims=True), 1e-12)
+
+        weights = (source_weights[nearest] * factors[:, :, np.newaxis]).sum(axis=1)
+
+        all_indices = np.arange(vert_count)
+        for group_index, name in enumerate(group_names):
+            column = weights[:, group_index]
+            affected = column > 0.0
+            vg = target.vertex_groups.get(name, None)
+            if vg:
+                vg.remove(all_indices.tolist())
+            elif affected.any():
+                vg = target.vertex_groups.new(name)
+            else:
+                continue
+            assign_vertex_weights(vg, all_indices[affected], column[affected])
+
+    def execute(self, context):
+        source = context.active_object
+        targets = [obj for obj in context.selected_objects
+                   if obj.type == 'MESH' and obj != source]
+        if not targets or not source.vertex_groups:
+            return {'CANCELLED'}
+
+        # Tree and weights are read once, shared by all targets.
+        tree = get_cached_kdtree(source)
+        source_weights = get_vertex_weights(source)
+        group_names = [vg.name for vg in source.vertex_groups]
+        for target in targets:
+            self.transfer_weights(tree, source_weights, group_names, target)
+
+        return {'FINISHED'}
+
+
 class ADH_SyncObjectDataNameToObject(Operator):
     """Sync an object data's name to the object's. Made it easier to reuse object data among separate files."""
     bl_idname = 'object.adh_sync_data_name_to_object'
@@ -1259,7 +3514,7 @@ class ADH_SyncObjectDataNameToObject(Operator):
 
     @classmethod
     def poll(self, context):
-        return context.selected_objects
+        return get_selection_facts(context).object_count > 0
 
     def execute(self, context):
         for obj in context.selected_objects:
@@ -1291,43 +3546,94 @@ class ADH_SyncCustomShapePositionToBone(Operator):
         return {'FINISHED'}
 
 
-class ADH_RapidPasteDriver(Operator):
-    """Paste driver until Escape button is pressed."""
-    bl_idname = 'object.adh_rapid_paste_driver'
-    bl_label = 'Rapid Paste Driver'
+class ADH_PasteDriverToSelected(Operator):
+    """Copies active bone's or object's driver on a property to the same property of all selected bones or objects."""
+    bl_idname = 'anim.adh_paste_driver_to_selected'
+    bl_label = 'Paste Driver to Selected'
     bl_options = {'REGISTER', 'UNDO'}
 
-    _timer = None
-    _space = None
+    data_path = StringProperty(
+        name='Data Path',
+        description='Driven property, relative to bone or object, e.g. \'location\' or \'["prop"]\'')
 
-    @classmethod
-    def poll(self, context):
-        return context.space_data.type == 'PROPERTIES'
+    array_index = IntProperty(
+        name='Index',
+        description='Array index of driven property, -1 for all or for non-array properties',
+        min=-1, default=-1)
 
-    def cancel(self, context):
-        context.window_manager.event_timer_remove(self._timer)
+    target = EnumProperty(
+        name='Target',
+        items=[('BONES', 'Selected Bones', 'Active pose bone to all selected pose bones'),
+               ('OBJECTS', 'Selected Objects', 'Active object to all selected objects')],
+        default='BONES')
 
-        return {'CANCELLED'}
+    @classmethod
+    def poll(cls, context):
+        return context.active_object is not None
 
-    def modal(self, context, event):
-        wm = context.window_manager
+    @staticmethod
+    def find_drivers(datablock, data_path, index):
+        """Returns {array index: driver F-curve} on a property, all indices if index is negative."""
+        if not datablock.animation_data:
+            return {}
+        return dict((fc.array_index, fc) for fc in datablock.animation_data.drivers
+                    if fc.data_path == data_path and (index < 0 or fc.array_index == index))
 
-        if event.type == 'ESC' or context.space_data != self._space:
-            wm.event_timer_remove(self._timer)
-            return {'FINISHED'}
-        elif event.type == 'TIMER':
-            bpy.ops.anim.paste_driver_button()
+    @staticmethod
+    def is_array_property(datablock, data_path):
+        try:
+            value = datablock.path_resolve(data_path)
+        except ValueError:
+            return False
+        return hasattr(value, '__len__') and not isinstance(value, str)
+
+    def get_owners(self, context):
+        """Returns (source (ID, path), [target (ID, path), ...])."""
+        separator = '' if self.data_path.startswith('[') else '.'
+        if self.target == 'BONES':
+            armature = context.active_object
+            bone_path = 'pose.bones["%s"]' + separator + self.data_path
+            source = (armature, bone_path % context.active_pose_bone.name)
+            targets = [(armature, bone_path % bone.name)
+                       for bone in context.selected_pose_bones
+                       if bone != context.active_pose_bone]
+        else:
+            source = (context.active_object, self.data_path)
+            targets = [(obj, self.data_path) for obj in context.selected_objects
+                       if obj != context.active_object]
+        return source, targets
 
-        return {'PASS_THROUGH'}
+    def execute(self, context):
+        if not self.data_path or \
+                (self.target == 'BONES' and not context.active_pose_bone):
+            return {'CANCELLED'}
 
-    def invoke(self, context, event):
-        wm = context.window_manager
+        (source_id, source_path), targets = self.get_owners(context)
+        source_fcs = self.find_drivers(source_id, source_path, self.array_index)
+        if not source_fcs:
+            self.report({'ERROR'}, "No driver on %s" % source_path)
+            return {'CANCELLED'}
+        # One template per channel, e.g. X, Y and Z of location each keep their own
+        templates = dict((index, ADH_DriverTemplate(fc.driver, fc))
+                         for index, fc in source_fcs.items())
+        is_array = self.is_array_property(source_id, source_path)
+
+        pasted = 0
+        created = 0
+        for target_id, target_path in targets:
+            existing = self.find_drivers(target_id, target_path, self.array_index)
+            for index, template in sorted(templates.items()):
+                try:
+                    fc = target_id.driver_add(target_path, index if is_array else -1)
+                except TypeError:
+                    break  # Property doesn't exist on this target
+                template.apply_fcurve(fc)
+                pasted += 1
+                created += 0 if index in existing else 1
 
-        wm.modal_handler_add(self)
-        self._timer = wm.event_timer_add(0.1, context.window)
-        self._space = context.space_data
+        self.report({'INFO'}, "%d drivers pasted, %d newly created" % (pasted, created))
 
-        return {'RUNNING_MODAL'}
+        return {'FINISHED'}
 
 
 class ADH_MapShapeKeysToBones(Operator):
@@ -1349,11 +3655,19 @@ class ADH_MapShapeKeysToBones(Operator):
         subtype="DISTANCE", unit="LENGTH",
     )
 
+    driver_mode = EnumProperty(
+        name="Driver Mode",
+        items=[("SIMPLE", "Simple",
+                "Single-variable driver scaled by F-curve Generator modifier, needs no Python"),
+               ("SCRIPTED", "Scripted", "Scripted expression driver")],
+        default="SIMPLE",
+    )
+
     @classmethod
     def poll(self, context):
         return context.active_object != None \
                and context.active_object.type in ['MESH', 'LATTICE'] \
-               and len(context.selected_objects) == 2
+               and get_selection_facts(context).object_count == 2
 
     def execute(self, context):
         obj1, obj2 = context.selected_objects
@@ -1370,7 +3684,9 @@ class ADH_MapShapeKeysToBones(Operator):
         if not mesh_keys.animation_data:
             mesh_keys.animation_data_create()
 
-        slider_formula = "a * %0.1f" % (1.0 / self.slider_distance) \
+        slider_scale = 1.0 / self.slider_distance \
+            if self.slider_distance != 0.0 else 1.0
+        slider_formula = "a * %0.1f" % slider_scale \
             if self.slider_distance != 0.0 else "a"
         for shape in mesh_keys.key_blocks:
             # Create driver only if the shape key isn't Basis, the
@@ -1394,20 +3710,75 @@ class ADH_MapShapeKeysToBones(Operator):
             target.transform_space = "LOCAL_SPACE"
             target.transform_type = self.slider_axis
 
-            fc.driver.type = "SCRIPTED"
-            fc.driver.expression = slider_formula
+            if self.driver_mode == "SIMPLE" \
+                    and set_driver_linear_mapping(fc, slider_scale, 0.0):
+                fc.driver.type = "AVERAGE"
+            else:
+                set_driver_linear_mapping(fc, 1.0, 0.0)
+                fc.driver.type = "SCRIPTED"
+                fc.driver.expression = slider_formula
 
         return {"FINISHED"}
 
 
+class ADH_ConvertScriptedDrivers(Operator):
+    """Converts linear single-variable scripted drivers of selected objects into drivers that need no Python."""
+    bl_idname = 'object.adh_convert_scripted_drivers'
+    bl_label = 'Convert Scripted Drivers'
+    bl_options = {'REGISTER', 'UNDO'}
+
+    @classmethod
+    def poll(self, context):
+        return get_selection_facts(context).object_count > 0
+
+    def convert_driver(self, fc):
+        driver = fc.driver
+        if driver.type != 'SCRIPTED' or len(driver.variables) != 1:
+            return False
+        mapping = parse_linear_expression(driver.expression, driver.variables[0].name)
+        if mapping is None:
+            return False
+
+        scale, offset = mapping
+        mod = get_driver_generator(fc)
+        if not mod:
+            return False
+        # Compose with the existing generator: c0 + c1 * (scale * x + offset)
+        c0, c1 = mod.coefficients[0], mod.coefficients[1]
+        set_driver_linear_mapping(fc, c1 * scale, c0 + c1 * offset)
+        driver.type = 'AVERAGE'
+        return True
+
+    def execute(self, context):
+        converted = 0
+        skipped = 0
+        visited = set()
+        for obj in context.selected_objects:
+            for datablock in get_animatable_datablocks(obj):
+                if not datablock or not datablock.animation_data \
+                        or datablock.as_pointer() in visited:
+                    continue
+                visited.add(datablock.as_pointer())
+                for fc in datablock.animation_data.drivers:
+                    if fc.driver.type != 'SCRIPTED':
+                        continue
+                    if self.convert_driver(fc):
+                        converted += 1
+                    else:
+                        skipped += 1
+
+        self.report({'INFO'}, "%d drivers converted, %d scripted drivers left" %
+                    (converted, skipped))
+
+        return {'FINISHED'}
+
+
 class ADH_CopyDriverSettings(Operator):
     """Copy driver settings."""
     bl_idname = 'anim.adh_copy_driver_settings'
     bl_label = 'Copy Driver Settings'
     bl_options = {'REGISTER', 'UNDO'}
 
-    increment_dict = {}
-
     @classmethod
     def poll(self, context):
         return context.space_data.type == 'GRAPH_EDITOR' \
@@ -1419,103 +3790,421 @@ class ADH_CopyDriverSettings(Operator):
         obj = context.active_object
         props = context.scene.adh_rigging_tools
 
-        self.generate_increment_dict(props.driver_increment_index)
-        shape_keys = getattr(obj.data, 'shape_keys', None)
-        keyable_list = [shape_keys] if shape_keys else []
-        for ms in obj.material_slots:
-            if not ms:
-                continue
-            keyable_list.append(ms.material)
-            for ts in ms.material.texture_slots:
-                if not ts:
-                    continue
-                keyable_list.append(ts.texture)
-        for ps in obj.particle_systems:
-            keyable_list.append(ps.settings)
-        keyable_list.append(obj)
-        keyable_list.append(obj.data)
+        increments = parse_increments(props.driver_increment_index)
+        keyable_list = get_animatable_datablocks(obj)
 
-        self.process_keyable_list(context, keyable_list)
+        copy_selected_drivers(keyable_list, increments)
 
         return {'FINISHED'}
 
-    def generate_increment_dict(self, increment_list_str):
-        increment_dict_re = re.compile(r"(\d+)\D*([+-])\D*(\d+)\D*")
 
-        start_pos = 0
-        key = 0
-        increment = 0
-        while True:
-            match_obj = increment_dict_re.search(increment_list_str, start_pos)
-            if not match_obj:
-                break
+class ADH_BatchEditDrivers(Operator):
+    """Edits all drivers in the file whose data path matches a pattern. Needs no UI, usable in background mode."""
+    bl_idname = 'anim.adh_batch_edit_drivers'
+    bl_label = 'Batch Edit Drivers'
+    bl_options = {'REGISTER', 'UNDO'}
+
+    action = EnumProperty(
+        name='Action',
+        items=[('REWRITE', 'Rewrite Expressions', 'Substitute regular expression matches in expressions'),
+               ('RETARGET', 'Retarget', 'Point variable targets from one object to another'),
+               ('TEMPLATE', 'Copy Template', 'Copy first matching driver to all other matching drivers')],
+        default='REWRITE')
+
+    id_type = EnumProperty(
+        name='ID Type',
+        items=[('ALL', 'All', 'Drivers of all ID types')] +
+              [(id_type, id_type.title().replace('_', ' '), '') for id_type in DRIVER_ID_COLLECTIONS],
+        default='ALL')
+
+    path_pattern = StringProperty(
+        name='Data Path Pattern',
+        description='Regular expression searched in driven data paths. Empty matches all')
+
+    search_pattern = StringProperty(
+        name='Search',
+        description='Regular expression searched in expressions, or in bone targets when retargeting')
+
+    replacement = StringProperty(
+        name='Replacement',
+        description='Replacement for each match')
+
+    old_target = StringProperty(
+        name='Old Target',
+        description='Name of object currently targeted by driver variables')
+
+    new_target = StringProperty(
+        name='New Target',
+        description='Name of object to target instead')
+
+    increments = StringProperty(
+        name='Increments',
+        description='Increment for each n-th integer in template expression, e.g. "1+1 2-10"')
+
+    def execute(self, context):
+        if self.action == 'REWRITE' and not self.search_pattern:
+            self.report({'ERROR'}, "Search pattern is empty")
+            return {'CANCELLED'}
+
+        try:
+            count, entries = self.edit_drivers()
+        except re.error as e:
+            self.report({'ERROR'}, "Invalid regular expression: %s" % e)
+            return {'CANCELLED'}
+        if count is None:
+            return {'CANCELLED'}
+
+        self.report({'INFO'}, "%d of %d matching drivers changed" % (count, len(entries)))
+
+        return {'FINISHED'}
+
+    def edit_drivers(self):
+        """Returns count of drivers changed (None if nothing can be done) and matching entries."""
+        index = ADH_DriverIndex()
+        entries = index.find(None if self.id_type == 'ALL' else self.id_type,
+                             self.path_pattern)
+
+        if self.action == 'REWRITE':
+            count = index.rewrite_expressions(entries, self.search_pattern,
+                                              self.replacement)
+        elif self.action == 'RETARGET':
+            old_id = bpy.data.objects.get(self.old_target, None)
+            new_id = bpy.data.objects.get(self.new_target, None)
+            if not (old_id and new_id):
+                self.report({'ERROR'}, "Old and new targets must be existing objects")
+                return None, entries
+            count = index.retarget(entries, old_id, new_id,
+                                   self.search_pattern, self.replacement)
+        else:
+            if len(entries) < 2:
+                return None, entries
+            template = ADH_DriverTemplate(entries[0][2].driver)
+            count = index.apply_template(template, entries[1:],
+                                         parse_increments(self.increments))
+        return count, entries
+
+
+class ADH_ConsolidateDrivers(Operator):
+    """Finds drivers computing the same value, and adds one driver computing it onto a custom property read by all of them."""
+    bl_idname = 'anim.adh_consolidate_drivers'
+    bl_label = 'Consolidate Duplicate Drivers'
+    bl_options = {'REGISTER', 'UNDO'}
+
+    PROP_PREFIX = 'adh_driver_'
+
+    analyze_only = BoolProperty(
+        name='Analyze Only',
+        description='Only report duplicate drivers, without changing them.',
+        default=False)
+
+    def find_duplicates(self):
+        groups = OrderedDict()
+        for entry in ADH_DriverIndex().entries:
+            fc = entry[2]
+            if fc.keyframe_points:
+                continue  # Driver value remapped by a curve, leave it alone
+            signature = get_driver_signature(fc.driver)
+            if signature is not None:
+                groups.setdefault(signature, []).append(entry)
+        return [group for group in groups.values() if len(group) > 1]
+
+    def consolidate(self, group):
+        id_type, host, first_fc = group[0]
+
+        index = 0
+        while (self.PROP_PREFIX + '%d' % index) in host.keys():
+            index += 1
+        prop_name = self.PROP_PREFIX + '%d' % index
+        prop_path = '["%s"]' % prop_name
+        host[prop_name] = 0.0
+
+        master = host.driver_add(prop_path)
+        ADH_DriverTemplate(first_fc.driver).apply(master.driver)
+
+        for entry_id_type, datablock, fc in group:
+            if datablock == host:
+                # Drivers of one datablock are evaluated in order, readers
+                # must come after the property's driver.
+                fc = self.readd_driver(datablock, fc)
+            set_driver_property_reader(fc.driver, id_type, host, prop_path)
+
+    @staticmethod
+    def readd_driver(datablock, fc):
+        """Removes and re-adds a driver F-curve, evaluated last, with the same settings and modifiers."""
+        # Copied as plain values, the F-curve's memory is freed on removal
+        settings = OrderedDict((attr, serialize_setting(getattr(fc, attr)))
+                               for attr in DRIVER_FCURVE_ATTRIBUTES if hasattr(fc, attr))
+        modifiers = [(mod.type, OrderedDict((attr, serialize_setting(value)) for attr, value
+                                            in get_writable_settings(mod).items()))
+                     for mod in fc.modifiers]
+
+        data_path, array_index = fc.data_path, fc.array_index
+        datablock.driver_remove(data_path, array_index)
+        fc = datablock.driver_add(data_path, array_index)
+
+        for mod in list(fc.modifiers):  # driver_add creates a default Generator
+            fc.modifiers.remove(mod)
+        for mod_type, mod_settings in modifiers:
+            apply_settings(fc.modifiers.new(mod_type), mod_settings)
+        apply_settings(fc, settings)
+        return fc
 
-            key = int(match_obj.group(1))
-            increment = int(match_obj.group(3))
-            if (match_obj.group(2) == '-'):
-                increment *= -1
+    def execute(self, context):
+        duplicates = self.find_duplicates()
+        duplicate_count = sum(len(group) for group in duplicates)
+
+        if not self.analyze_only:
+            for group in duplicates:
+                self.consolidate(group)
+
+        self.report({'INFO'}, "%d drivers share %d distinct values%s" %
+                    (duplicate_count, len(duplicates), "" if self.analyze_only else
+                     ": %d drivers added to compute them once, the %d duplicates now read them"
+                     % (len(duplicates), duplicate_count)))
+
+        return {'FINISHED'}
+
+
+class ADH_ProfileDrivers(Operator):
+    """Times frame evaluation with each group of drivers in the file muted in turn, ranking the groups by cost."""
+    bl_idname = 'anim.adh_profile_drivers'
+    bl_label = 'Profile Drivers'
+    bl_options = {'REGISTER'}
+
+    group_by = EnumProperty(
+        name='Group By',
+        items=[('DATABLOCK', 'Datablock', 'One group for all drivers of a datablock'),
+               ('OWNER', 'Owner', 'One group for drivers of each bone, shape key, etc.')],
+        default='DATABLOCK')
+
+    frame_count = IntProperty(
+        name='Frames',
+        description="Number of frames evaluated for each measurement, starting at current frame.",
+        min=1, max=250, default=10)
+
+    @staticmethod
+    def get_group_name(datablock, fc, group_by):
+        name = "%s %s" % (type(datablock).__name__, datablock.name)
+        if group_by == 'OWNER':
+            # 'pose.bones["arm"].rotation_euler' -> 'pose.bones["arm"]'
+            bracket_end = fc.data_path.rfind(']')
+            if bracket_end >= 0:
+                name += ": " + fc.data_path[:bracket_end + 1]
+        return name
+
+    def execute(self, context):
+        scene = context.scene
+        props = scene.adh_rigging_tools
+
+        groups = OrderedDict()
+        for datablock, fc in iter_file_drivers():
+            name = self.get_group_name(datablock, fc, self.group_by)
+            groups.setdefault(name, []).append(fc)
+        if not groups:
+            return {'CANCELLED'}
 
-            self.increment_dict[key] = increment
-            start_pos = match_obj.end()
+        prev_frame = scene.frame_current
+        frames = list(range(prev_frame, prev_frame + self.frame_count))
+        time_frames(scene, frames)  # Warm up caches
+        baseline = time_frames(scene, frames)
+
+        results = []
+        for name, fcurves in groups.items():
+            prev_mute = [fc.mute for fc in fcurves]
+            for fc in fcurves:
+                fc.mute = True
+            try:
+                muted_time = time_frames(scene, frames)
+            finally:
+                for fc, mute in zip(fcurves, prev_mute):
+                    fc.mute = mute
+            python_count = len([fc for fc in fcurves if fc.driver.type == 'SCRIPTED'])
+            results.append((baseline - muted_time, name, len(fcurves), python_count))
+        scene.frame_set(prev_frame)
+
+        props.driver_profile.clear()
+        props.driver_profile_baseline = baseline * 1000.0 / len(frames)
+        for cost, name, driver_count, python_count in sorted(results, reverse=True):
+            item = props.driver_profile.add()
+            item.name = name
+            item.driver_count = driver_count
+            item.python_count = python_count
+            item.cost = cost * 1000.0 / len(frames)
 
-    def process_keyable_list(self, context, keyable_list):
+        return {'FINISHED'}
+
+
+class ADH_ExportDriverProfile(Operator, ExportHelper):
+    """Exports last driver profiling report as CSV."""
+    bl_idname = 'anim.adh_export_driver_profile'
+    bl_label = 'Export Driver Profile'
+    bl_options = {'REGISTER'}
+
+    filename_ext = '.csv'
+
+    filter_glob = StringProperty(
+        default='*.csv',
+        options={'HIDDEN'})
+
+    @classmethod
+    def poll(cls, context):
+        return len(context.scene.adh_rigging_tools.driver_profile) > 0
+
+    def execute(self, context):
         props = context.scene.adh_rigging_tools
+        with open(self.filepath, 'w', newline='') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(['rank', 'group', 'drivers', 'python_drivers', 'cost_ms_per_frame'])
+            writer.writerow([0, 'BASELINE', '', '', '%.6f' % props.driver_profile_baseline])
+            for rank, item in enumerate(props.driver_profile, 1):
+                writer.writerow([rank, item.name, item.driver_count, item.python_count,
+                                 '%.6f' % item.cost])
 
-        driver = None
-        index = 1
-        for keyable in keyable_list:
-            if not keyable or not keyable.animation_data:
-                continue
-            for fc in keyable.animation_data.drivers:
-                if not fc.select:
-                    continue
-                if driver:
-                    self.copy_driver_variables(fc, driver, index)
-                    index += 1
-                else:
-                    driver = fc.driver
-
-    def copy_driver_variables(self, fc, driver, driver_index):
-        fc.driver.show_debug_info = driver.show_debug_info
-        fc.driver.type = driver.type
-        fc.driver.expression = self.substitute_incremented(driver.expression,
-                                                           driver_index)
-
-        for dv in fc.driver.variables:
-            fc.driver.variables.remove(dv)
-        for dv in driver.variables:
-            fdv = fc.driver.variables.new()
-            fdv.name = dv.name
-            fdv.type = dv.type
-            target = fdv.targets[0]
-            target.bone_target = dv.targets[0].bone_target
-            target.id = dv.targets[0].id
-            # target.id_type = dv.targets[0].id_type
-            target.data_path = dv.targets[0].data_path
-            target.transform_space = dv.targets[0].transform_space
-            target.transform_type = dv.targets[0].transform_type
-
-    def substitute_incremented(self, expression, multiplier):
-        int_re = re.compile(r"\d+")
-
-        start_pos = 0
-        match_index = 1
-        newExpression = ''
-        while True:
-            match_obj = int_re.search(expression, start_pos)
-            if not match_obj:
-                newExpression += expression[start_pos:]
-                break
+        return {'FINISHED'}
 
-            newExpression += expression[start_pos:match_obj.start()]
-            value = int(match_obj.group()) + \
-                    (self.increment_dict.get(match_index, 0) * multiplier)
-            newExpression += str(value)
 
-            match_index += 1
-            start_pos = match_obj.end()
+class ADH_ProfileConstraints(Operator):
+    """Times frame range evaluation with each group of bone constraints muted in turn. Usable in background mode."""
+    bl_idname = 'object.adh_profile_constraints'
+    bl_label = 'Profile Constraints'
+    bl_options = {'REGISTER'}
+
+    armature_name = StringProperty(
+        name='Armature',
+        description='Armature to profile. Empty uses selected armatures, or all in scene if none selected')
+
+    group_by = EnumProperty(
+        name='Group By',
+        items=[('BONE', 'Bone', 'One group for all constraints of a bone'),
+               ('TYPE', 'Type', 'One group for all constraints of a type')],
+        default='BONE')
+
+    frame_start = IntProperty(
+        name='Start Frame',
+        description='First frame evaluated. Defaults to scene start if bigger than end frame',
+        default=1)
+
+    frame_end = IntProperty(
+        name='End Frame',
+        description='Last frame evaluated',
+        default=0)
+
+    filepath = StringProperty(
+        name='JSON Report',
+        description='File to write JSON report into. Empty writes none',
+        subtype='FILE_PATH')
+
+    REPORTED_COUNT = 5  # Costliest groups listed in the report, all go to the JSON report
+
+    def get_armatures(self, context):
+        if self.armature_name:
+            armature = bpy.data.objects.get(self.armature_name, None)
+            return [armature] if armature and armature.type == 'ARMATURE' else []
+        armatures = [obj for obj in (context.selected_objects or [])
+                     if obj.type == 'ARMATURE']
+        return armatures or [obj for obj in context.scene.objects
+                             if obj.type == 'ARMATURE']
+
+    def get_groups(self, armatures):
+        groups = OrderedDict()
+        for armature in armatures:
+            for pbone in armature.pose.bones:
+                for constraint in pbone.constraints:
+                    if constraint.mute:
+                        continue  # Already costs nothing
+                    name = "%s: %s" % (armature.name, pbone.name) \
+                        if self.group_by == 'BONE' else constraint.type
+                    groups.setdefault(name, []).append(constraint)
+        return groups
+
+    def write_report(self, report):
+        with open(bpy.path.abspath(self.filepath), 'w') as json_file:
+            json.dump(report, json_file, indent=2)
+
+    def execute(self, context):
+        scene = context.scene
+        armatures = self.get_armatures(context)
+        if self.armature_name and not armatures:
+            self.report({'ERROR'}, "No armature named %s" % self.armature_name)
+            return {'CANCELLED'}
+        groups = self.get_groups(armatures)
+        if not groups:
+            self.report({'WARNING'}, "No unmuted bone constraints to profile")
+            return {'CANCELLED'}
+
+        frame_start, frame_end = self.frame_start, self.frame_end
+        if frame_start > frame_end:
+            frame_start, frame_end = scene.frame_start, scene.frame_end
+        frames = list(range(frame_start, frame_end + 1))
+        prev_frame = scene.frame_current
+
+        time_frames(scene, frames)  # Warm up caches
+        baseline = time_frames(scene, frames)
+
+        results = []
+        for name, constraints in groups.items():
+            for constraint in constraints:
+                constraint.mute = True
+            try:
+                muted_time = time_frames(scene, frames)
+            finally:
+                for constraint in constraints:
+                    constraint.mute = False
+            results.append((baseline - muted_time, name, len(constraints)))
+        scene.frame_set(prev_frame)
+        results.sort(reverse=True)
+
+        ms_per_frame = 1000.0 / len(frames)
+
+        if self.filepath:
+            self.write_report(dict(
+                frames=[frame_start, frame_end],
+                group_by=self.group_by,
+                baseline_ms_per_frame=baseline * ms_per_frame,
+                groups=[dict(name=name, constraint_count=count, cost_ms_per_frame=cost * ms_per_frame)
+                        for cost, name, count in results]))
+
+        self.report({'INFO'}, "%d constraint groups profiled, baseline %.4f ms/frame, most costly: %s" %
+                    (len(results), baseline * ms_per_frame,
+                     "; ".join("%s %.4f ms/frame (%d)" % (name, cost * ms_per_frame, count)
+                               for cost, name, count in results[:self.REPORTED_COUNT])))
+
+        return {'FINISHED'}
+
+
+class ADH_ExportOperatorLog(Operator, ExportHelper):
+    """Exports instrumented operator calls, with their profiles if captured, as JSON."""
+    bl_idname = 'wm.adh_export_operator_log'
+    bl_label = 'Export Operator Log'
+    bl_options = {'REGISTER'}
+
+    filename_ext = '.json'
+
+    filter_glob = StringProperty(
+        default='*.json',
+        options={'HIDDEN'})
+
+    @classmethod
+    def poll(cls, context):
+        return len(_operator_log) > 0
 
-        return newExpression
+    def execute(self, context):
+        with open(self.filepath, 'w') as json_file:
+            json.dump(list(_operator_log), json_file, indent=2)
+
+        return {'FINISHED'}
+
+
+class ADH_ClearOperatorLog(Operator):
+    """Clears the instrumented operator call log."""
+    bl_idname = 'wm.adh_clear_operator_log'
+    bl_label = 'Clear Operator Log'
+    bl_options = {'REGISTER'}
+
+    def execute(self, context):
+        _operator_log.clear()
+
+        return {'FINISHED'}
 
 
 def draw_armature_specials(self, context):
@@ -1545,6 +4234,23 @@ class GRAPH_PT_adh_rigging_tools(Panel):
         col.prop(props, 'driver_increment_index')
         col.operator('anim.adh_copy_driver_settings')
 
+        col = layout.column(align=1)
+        col.operator('object.adh_convert_scripted_drivers')
+        col.operator('anim.adh_paste_driver_to_selected')
+        col.operator('anim.adh_consolidate_drivers')
+
+        col = layout.column(align=1)
+        row = col.row(align=1)
+        row.operator('anim.adh_profile_drivers')
+        row.operator('anim.adh_export_driver_profile', text='', icon='EXPORT')
+        if props.driver_profile:
+            col.label('Baseline: %.3f ms/frame' % props.driver_profile_baseline)
+            for item in props.driver_profile[:10]:
+                row = col.row()
+                row.label(item.name)
+                row.label('%.3f ms, %d/%d Py' % (item.cost, item.python_count,
+                                                 item.driver_count))
+
 
 class VIEW3D_PT_adh_rigging_tools(Panel):
     bl_label = 'ADH Rigging Tools'
@@ -1564,8 +4270,11 @@ class VIEW3D_PT_adh_rigging_tools(Panel):
         row = layout.row()
         col = row.column(align=1)
         col.operator('lattice.adh_bind_to_objects')
+        col.operator('lattice.adh_convert_hooks_to_armature')
         col.operator('mesh.adh_add_subsurf_modifier', text='Add Subsurf')
         col.operator('mesh.adh_apply_lattices')
+        col.operator('mesh.adh_bake_lattice_shape_key')
+        col.operator('mesh.adh_lattice_to_armature_weights')
         row1 = col.row(align=1)
         row1.operator('mesh.adh_mask_selected_vertices')
         row1.operator('mesh.adh_delete_mask', text='', icon='CANCEL')
@@ -1576,6 +4285,11 @@ class VIEW3D_PT_adh_rigging_tools(Panel):
         col.operator('armature.adh_use_same_shape')
         col.operator('armature.adh_create_shape')
         col.operator('armature.adh_select_shape')
+        col.operator('armature.adh_select_shape_users')
+        row1 = col.row(align=1)
+        row1.operator('object.adh_select_unused_shapes', text='Unused Shapes')
+        row1.operator('object.adh_report_shared_shapes', text='Shared Shapes')
+        col.operator('armature.adh_copy_constraints')
 
         row = layout.row()
         col = row.column(align=1)
@@ -1586,6 +4300,16 @@ class VIEW3D_PT_adh_rigging_tools(Panel):
         col.operator('armature.adh_remove_vertex_groups_unselected_bones',
                      text='Remove Unselected VG')
         col.operator('armature.adh_bind_to_bone')
+        col.operator('object.adh_transfer_weights')
+        row1 = col.row(align=1)
+        row1.operator('armature.adh_bake_constraints')
+        row1.operator('armature.adh_unbake_constraints', text='', icon='CANCEL')
+
+        row = layout.row()
+        col = row.column(align=1)
+        row1 = col.row(align=1)
+        row1.operator('object.adh_prune_dead_constraints')
+        row1.operator('object.adh_restore_pruned', text='', icon='LOOP_BACK')
 
         row = layout.row()
         col = row.column(align=1)
@@ -1593,6 +4317,31 @@ class VIEW3D_PT_adh_rigging_tools(Panel):
         col.operator('object.adh_sync_shape_position_to_bone', text='CustShape.pos <- Bone.pos')
 
 
+class VIEW3D_PT_adh_operator_log(Panel):
+    bl_label = 'ADH Operator Log'
+    bl_space_type = 'VIEW_3D'
+    bl_region_type = 'TOOLS'
+    bl_category = 'Tools'
+    bl_options = {'DEFAULT_CLOSED'}
+
+    @classmethod
+    def poll(cls, context):
+        return bool(_instrumented_methods)
+
+    def draw(self, context):
+        layout = self.layout
+
+        row = layout.row(align=1)
+        row.operator('wm.adh_export_operator_log', text='Export', icon='EXPORT')
+        row.operator('wm.adh_clear_operator_log', text='Clear', icon='X')
+
+        col = layout.column(align=1)
+        for entry in reversed(list(_operator_log)[-15:]):
+            row = col.row()
+            row.label(entry['operator'].split('.')[-1])
+            row.label('%.3fs, %d/%d' % (entry['seconds'], entry['objects'], entry['bones']))
+
+
 class VIEW3D_MT_adh_object_specials(Menu):
     bl_label = "ADH Rigging Tools"
 
@@ -1602,7 +4351,9 @@ class VIEW3D_MT_adh_object_specials(Menu):
 
         col = row.column()
         col.operator('lattice.adh_bind_to_objects')
+        col.operator('lattice.adh_convert_hooks_to_armature')
         col.operator('object.adh_map_shape_keys_to_bones')
+        col.operator('object.adh_convert_scripted_drivers')
 
         col = row.column()
         col.operator('object.adh_sync_data_name_to_object', text='ObData.name <- Ob.name')
@@ -1619,6 +4370,7 @@ class VIEW3D_MT_adh_armature_specials(Menu):
         col.operator('armature.adh_use_same_shape')
         col.operator('armature.adh_create_shape')
         col.operator('armature.adh_select_shape')
+        col.operator('armature.adh_select_shape_users')
 
         col.separator()
         col.operator('object.adh_sync_shape_position_to_bone', text='CustShape.pos <- Bone.pos')
@@ -1630,6 +4382,8 @@ class VIEW3D_MT_adh_armature_specials(Menu):
         col.operator('armature.adh_remove_vertex_groups_unselected_bones',
                      text='Remove Unselected VG')
         col.operator('armature.adh_bind_to_bone')
+        col.operator('armature.adh_copy_constraints')
+        col.operator('anim.adh_paste_driver_to_selected')
 
 
 class ADH_RiggingToolsPreferences(bpy.types.AddonPreferences):
@@ -1640,6 +4394,19 @@ class ADH_RiggingToolsPreferences(bpy.types.AddonPreferences):
         name="Hide Particles Modifier")
     hide_multires_modifier = BoolProperty(
         name="Hide MultiRes Modifier")
+    log_operators = BoolProperty(
+        name="Log Operator Timing",
+        description="Record wall-clock time and selection size of every call to this add-on's operators",
+        update=lambda self, context: set_operator_instrumentation(self.log_operators))
+    profile_operators = BoolProperty(
+        name="Profile Operators",
+        description="Also capture cProfile statistics of each logged call. Slows operators down",
+        update=lambda self, context: _instrumentation.update(profile=self.profile_operators))
+    log_size = IntProperty(
+        name="Log Size",
+        description="Number of most recent operator calls kept",
+        min=1, default=100,
+        update=lambda self, context: update_operator_log_size(self.log_size))
 
     def draw(self, context):
         layout = self.layout
@@ -1647,6 +4414,25 @@ class ADH_RiggingToolsPreferences(bpy.types.AddonPreferences):
         layout.prop(self, "hide_particles_modifier")
         layout.prop(self, "hide_multires_modifier")
 
+        row = layout.row()
+        row.prop(self, "log_operators")
+        sub = row.row()
+        sub.active = self.log_operators
+        sub.prop(self, "profile_operators")
+        sub.prop(self, "log_size")
+
+
+class ADH_DriverProfileItem(bpy.types.PropertyGroup):
+    driver_count = IntProperty(
+        name='Drivers',
+        description='Number of drivers in the group')
+    python_count = IntProperty(
+        name='Python Drivers',
+        description='Number of drivers in the group requiring Python evaluation')
+    cost = FloatProperty(
+        name='Cost',
+        description='Frame evaluation time saved by muting the group, in milliseconds per frame')
+
 
 class ADH_RiggingToolsProps(bpy.types.PropertyGroup):
     driver_increment_index = StringProperty(
@@ -1661,6 +4447,13 @@ class ADH_RiggingToolsProps(bpy.types.PropertyGroup):
         name='',
         description='String to replace each match',
         options={'SKIP_SAVE'})
+    driver_profile = CollectionProperty(
+        type=ADH_DriverProfileItem,
+        options={'SKIP_SAVE'})
+    driver_profile_baseline = FloatProperty(
+        name='Baseline',
+        description='Frame evaluation time with no driver muted, in milliseconds per frame',
+        options={'SKIP_SAVE'})
 
 
 @persistent
@@ -1689,22 +4482,61 @@ def turn_off_glsl_handler(dummy):
                 mod.show_viewport = False
 
 
+@persistent
+def clear_caches_handler(dummy):
+    _kdtree_cache.clear()
+    _selection_facts['key'] = None
+    invalidate_widget_index()
+
+
+@persistent
+def invalidate_caches_handler(*args):
+    # Selection changes aren't flagged before 2.8, but this handler then
+    # runs once per event loop pass, before redraws. So polls of a redraw
+    # share one set of facts, and never see a stale selection.
+    _selection_facts['key'] = None
+
+    # Depsgraph updates (2.8+) only come with changes, scene updates don't
+    if not hasattr(bpy.app.handlers, 'depsgraph_update_post') and \
+            not (bpy.data.objects.is_updated or bpy.data.armatures.is_updated):
+        return
+    # Rebuilt lazily, only when a widget lookup needs it
+    invalidate_widget_index()
+
+
+def get_update_handlers():
+    handlers = bpy.app.handlers
+    return getattr(handlers, 'depsgraph_update_post', None) or handlers.scene_update_post
+
+
 def register():
     bpy.utils.register_module(__name__)
 
     bpy.types.Scene.adh_rigging_tools = PointerProperty \
         (type=ADH_RiggingToolsProps)
     bpy.app.handlers.load_post.append(turn_off_glsl_handler)
+    bpy.app.handlers.load_post.append(clear_caches_handler)
+    get_update_handlers().append(invalidate_caches_handler)
     bpy.types.VIEW3D_MT_object_specials.append(draw_object_specials)
     bpy.types.VIEW3D_MT_armature_specials.append(draw_armature_specials)
     bpy.types.VIEW3D_MT_pose_specials.append(draw_armature_specials)
 
+    addon = bpy.context.user_preferences.addons.get(__name__, None)
+    if addon and addon.preferences:
+        prefs = addon.preferences
+        _instrumentation['profile'] = prefs.profile_operators
+        update_operator_log_size(prefs.log_size)
+        set_operator_instrumentation(prefs.log_operators)
+
 
 def unregister():
+    set_operator_instrumentation(False)
     bpy.utils.unregister_module(__name__)
 
     del bpy.types.Scene.adh_rigging_tools
     bpy.app.handlers.load_post.remove(turn_off_glsl_handler)
+    bpy.app.handlers.load_post.remove(clear_caches_handler)
+    get_update_handlers().remove(invalidate_caches_handler)
     bpy.types.VIEW3D_MT_object_specials.remove(draw_object_specials)
     bpy.types.VIEW3D_MT_armature_specials.remove(draw_armature_specials)
     bpy.types.VIEW3D_MT_pose_specials.remove(draw_armature_specials)
@@ -0,0 +1,403 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Author: Adhi Hargo (cadmus.sw@gmail.com)
+
+"""Times ADH Rigging Tools operators on procedurally generated rigs, in background Blender.
+
+    blender -b --factory-startup -P benchmark.py -- [--scale 2] [--repeat 3]
+        [--only create_hooks,apply_lattices] [--output result.json]
+        [--baseline baseline.json] [--tolerance 0.2]
+
+Each benchmark builds its rig from an empty file, then only the operator
+call is timed. With --baseline, benchmarks slower than the baseline by
+more than the tolerance are reported as regressions and Blender exits
+with status 1."""
+
+import argparse
+import importlib.util
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import time
+from collections import OrderedDict
+
+import bpy
+from mathutils import Vector
+
+ADDON_DIR = os.path.dirname(os.path.abspath(__file__))
+ADDON_NAME = os.path.basename(ADDON_DIR)
+
+# Rig sizes at --scale 1
+BASE_SIZE = OrderedDict([
+    ('bones', 200), ('meshes', 20), ('vertices', 10000), ('vertex_groups', 20),
+    ('lattice_resolution', 8), ('shape_keys', 20), ('drivers', 200)])
+
+BENCHMARKS = OrderedDict()
+
+
+def benchmark(name):
+    """Registers a function that builds a rig and returns the call to time."""
+
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+
+    return decorator
+
+
+def load_addon():
+    if ADDON_NAME in sys.modules:
+        return sys.modules[ADDON_NAME]
+    spec = importlib.util.spec_from_file_location(
+        ADDON_NAME, os.path.join(ADDON_DIR, '__init__.py'),
+        submodule_search_locations=[ADDON_DIR])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[ADDON_NAME] = module
+    spec.loader.exec_module(module)
+    module.register()
+    return module
+
+
+def reset_file():
+    scene = bpy.context.scene
+    if scene.objects.active and scene.objects.active.mode != 'OBJECT':
+        bpy.ops.object.mode_set(mode='OBJECT')
+    for obj in list(bpy.data.objects):
+        bpy.data.objects.remove(obj, do_unlink=True)
+    for collection in (bpy.data.meshes, bpy.data.armatures, bpy.data.lattices,
+                       bpy.data.actions):
+        for datablock in list(collection):
+            if not datablock.users:
+                collection.remove(datablock)
+    random.seed(0)  # Same rig on every run
+
+
+def link_object(name, data):
+    scene = bpy.context.scene
+    obj = bpy.data.objects.new(name, data)
+    scene.objects.link(obj)
+    return obj
+
+
+def activate(obj, mode='OBJECT', selected=()):
+    scene = bpy.context.scene
+    if scene.objects.active and scene.objects.active.mode != 'OBJECT':
+        bpy.ops.object.mode_set(mode='OBJECT')
+    for other in scene.objects:
+        other.select = other in selected or other == obj
+    scene.objects.active = obj
+    if mode != 'OBJECT':
+        bpy.ops.object.mode_set(mode=mode)
+
+
+def make_armature(name, bone_count):
+    """Creates an armature with bones laid out on a grid, all selected."""
+    obj = link_object(name, bpy.data.armatures.new(name))
+    activate(obj, 'EDIT')
+    side = max(int(math.ceil(math.sqrt(bone_count))), 1)
+    for index in range(bone_count):
+        bone = obj.data.edit_bones.new('bone.%04d' % index)
+        bone.head = Vector(((index % side) * .2, (index // side) * .2, 0))
+        bone.tail = bone.head + Vector((0, 0, .1))
+        bone.select = True
+    activate(obj)
+    return obj
+
+
+def make_mesh(name, vertex_count, location=(0, 0, 0)):
+    """Creates a quad grid mesh with about vertex_count vertices."""
+    side = max(int(math.ceil(math.sqrt(vertex_count))), 2)
+    vertices = [(x / side, y / side, 0) for y in range(side) for x in range(side)]
+    faces = [(y * side + x, y * side + x + 1, (y + 1) * side + x + 1, (y + 1) * side + x)
+             for y in range(side - 1) for x in range(side - 1)]
+    data = bpy.data.meshes.new(name)
+    data.from_pydata(vertices, [], faces)
+    data.update()
+    obj = link_object(name, data)
+    obj.location = location
+    return obj
+
+
+def add_vertex_groups(obj, count):
+    vertex_count = len(obj.data.vertices)
+    for group_index in range(count):
+        vg = obj.vertex_groups.new('bone.%04d' % group_index)
+        vg.add(list(range(group_index, vertex_count, count)), random.random(), 'REPLACE')
+
+
+def add_lattice(obj, resolution):
+    data = bpy.data.lattices.new(obj.name + '_lattice')
+    data.points_u = data.points_v = data.points_w = resolution
+    lattice = link_object(obj.name + '_lattice', data)
+    lattice.location = obj.location + Vector((.5, .5, 0))
+    for point in data.points:
+        point.co_deform = point.co_deform + Vector((0, 0, random.uniform(-.1, .1)))
+    mod = obj.modifiers.new('Lattice', 'LATTICE')
+    mod.object = lattice
+    return lattice
+
+
+def add_shape_keys(obj, count):
+    obj.shape_key_add('Basis')
+    return [obj.shape_key_add('key.%04d' % index) for index in range(count)]
+
+
+def add_drivers(obj, count, source):
+    """Adds scripted drivers onto the first count shape key values, all selected in the channel list."""
+    fcurves = []
+    for index, key_block in enumerate(obj.data.shape_keys.key_blocks[1:count + 1]):
+        fc = key_block.driver_add('value')
+        fc.driver.type = 'SCRIPTED'
+        fc.driver.expression = '(var * 2) + %d' % index
+        var = fc.driver.variables.new()
+        var.name = 'var'
+        var.targets[0].id = source
+        var.targets[0].data_path = 'location.x'
+        fc.select = True
+        fcurves.append(fc)
+    return fcurves
+
+
+def run_operator(operator, **kwargs):
+    return lambda: operator(**kwargs)
+
+
+@benchmark('rename_regex')
+def bench_rename_regex(size):
+    armature = make_armature('rig', size['bones'])
+    activate(armature, 'POSE')
+    props = bpy.context.scene.adh_rigging_tools
+    props.regex_search_pattern = r'^bone\.(\d+)$'
+    props.regex_replacement_string = r'ctrl.\1'
+    return run_operator(bpy.ops.object.adh_rename_regex)
+
+
+@benchmark('copy_custom_shapes')
+def bench_copy_custom_shapes(size):
+    source = make_armature('rig_src', size['bones'])
+    target = make_armature('rig_dst', size['bones'])
+    widgets = [make_mesh('widget.%02d' % index, 16) for index in range(10)]
+    for index, pbone in enumerate(source.pose.bones):
+        pbone.custom_shape = widgets[index % len(widgets)]
+    activate(source, selected=[target])
+    return run_operator(bpy.ops.armature.adh_copy_shapes)
+
+
+@benchmark('create_custom_shape')
+def bench_create_custom_shape(size):
+    armature = make_armature('rig', size['bones'])
+    activate(armature, 'POSE')
+    armature.data.bones.active = armature.data.bones[0]
+    return run_operator(bpy.ops.armature.adh_create_shape, widget_shape='sphere')
+
+
+@benchmark('create_hooks_bones')
+def bench_create_hooks_bones(size):
+    armature = make_armature('rig', size['bones'])
+    activate(armature, 'POSE')
+    return run_operator(bpy.ops.armature.adh_create_hooks)
+
+
+@benchmark('create_hooks_lattice')
+def bench_create_hooks_lattice(size):
+    armature = make_armature('rig', 1)
+    mesh = make_mesh('body', size['vertices'])
+    lattice = add_lattice(mesh, size['lattice_resolution'])
+    for point in lattice.data.points:
+        point.select = True
+    activate(lattice, selected=[armature])
+    return run_operator(bpy.ops.armature.adh_create_hooks, lattice_binding='ARMATURE',
+                        cluster_count=size['bones'])
+
+
+@benchmark('create_spokes')
+def bench_create_spokes(size):
+    armature = make_armature('rig', 1)
+    mesh = make_mesh('eyelid', size['bones'])
+    activate(mesh, 'EDIT', selected=[armature])
+    bpy.ops.mesh.select_all(action='SELECT')
+    return run_operator(bpy.ops.armature.adh_create_spokes)
+
+
+@benchmark('bind_to_bone')
+def bench_bind_to_bone(size):
+    armature = make_armature('rig', size['bones'])
+    meshes = [make_mesh('prop.%03d' % index, size['vertices'] // size['meshes'],
+                        location=(index, 0, 0))
+              for index in range(size['meshes'])]
+    for mesh in meshes:
+        add_vertex_groups(mesh, size['vertex_groups'])
+    activate(armature, selected=meshes)
+    bpy.ops.object.mode_set(mode='POSE')
+    armature.data.bones.active = armature.data.bones[0]
+    return run_operator(bpy.ops.armature.adh_bind_to_bone)
+
+
+@benchmark('mask_selected_vertices')
+def bench_mask_selected_vertices(size):
+    mesh = make_mesh('body', size['vertices'])
+    add_vertex_groups(mesh, size['vertex_groups'])
+    for vertex in mesh.data.vertices:
+        vertex.select = vertex.index % 2 == 0
+    activate(mesh)
+    return run_operator(bpy.ops.mesh.adh_mask_selected_vertices, action='add')
+
+
+@benchmark('apply_lattices')
+def bench_apply_lattices(size):
+    meshes = [make_mesh('body.%03d' % index, size['vertices'] // size['meshes'],
+                        location=(index * 2, 0, 0))
+              for index in range(size['meshes'])]
+    for mesh in meshes:
+        add_shape_keys(mesh, size['shape_keys'])
+        add_lattice(mesh, size['lattice_resolution'])
+    activate(meshes[0], selected=meshes)
+    return run_operator(bpy.ops.mesh.adh_apply_lattices)
+
+
+@benchmark('copy_driver_settings')
+def bench_copy_driver_settings(size):
+    addon = sys.modules[ADDON_NAME]
+    control = link_object('control', None)
+    mesh = make_mesh('face', 100)
+    add_shape_keys(mesh, size['drivers'])
+    add_drivers(mesh, size['drivers'], control)
+    activate(mesh)
+    props = bpy.context.scene.adh_rigging_tools
+    props.driver_increment_index = '1+1 2-1'
+
+    # Its poll needs a Graph Editor in Drivers mode, which background
+    # Blender doesn't have, so the operator's work is called directly.
+    increments = addon.parse_increments(props.driver_increment_index)
+    keyable_list = addon.get_animatable_datablocks(mesh)
+
+    def copy_driver_settings():
+        addon.copy_selected_drivers(keyable_list, increments)
+        return {'FINISHED'}
+
+    return copy_driver_settings
+
+
+def run_benchmark(name, size, repeat):
+    timings = []
+    status = 'OK'
+    for _ in range(repeat):
+        reset_file()
+        try:
+            call = BENCHMARKS[name](size)
+            start = time.perf_counter()
+            result = call()
+            timings.append(time.perf_counter() - start)
+        except Exception as e:
+            status = 'ERROR: %s' % e
+            break
+        if 'FINISHED' not in result:
+            status = 'NOT FINISHED: %s' % ', '.join(sorted(result))
+            break
+    return OrderedDict([
+        ('status', status),
+        ('min', min(timings) if timings else None),
+        ('median', statistics.median(timings) if timings else None),
+        ('repeat', len(timings))])
+
+
+def compare(results, baseline, tolerance):
+    """Returns names of benchmarks slower than their baseline beyond tolerance."""
+    regressions = []
+    print("\n%-24s %10s %10s %8s" % ('benchmark', 'baseline', 'current', 'change'))
+    for name, result in results.items():
+        base = baseline.get('results', {}).get(name, {}).get('min', None)
+        current = result['min']
+        if base is None or current is None:
+            print("%-24s %10s %10s %8s" % (name, base, current, '-'))
+            continue
+        change = (current - base) / base if base else 0.0
+        flag = ''
+        if change > tolerance:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print("%-24s %9.4fs %9.4fs %+7.1f%%%s" % (name, base, current, change * 100, flag))
+    return regressions
+
+
+def parse_args():
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    parser = argparse.ArgumentParser(prog='blender -b -P benchmark.py --')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='Multiplier for all rig sizes')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Runs per benchmark, each on a freshly built rig')
+    parser.add_argument('--only', default='',
+                        help='Comma-separated benchmark names to run')
+    parser.add_argument('--output', default='',
+                        help='JSON file to write results into')
+    parser.add_argument('--baseline', default='',
+                        help='JSON results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed slowdown against baseline, 0.2 being 20%%')
+    for key, value in BASE_SIZE.items():
+        parser.add_argument('--' + key.replace('_', '-'), type=int, default=None,
+                            help='Overrides scaled %s (default %d)' % (key, value))
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    load_addon()
+
+    size = OrderedDict()
+    for key, value in BASE_SIZE.items():
+        override = getattr(args, key)
+        size[key] = override if override is not None else \
+            max(int(round(value * args.scale)), 2)
+
+    names = [name.strip() for name in args.only.split(',') if name.strip()] \
+        or list(BENCHMARKS.keys())
+
+    results = OrderedDict()
+    for name in names:
+        results[name] = run_benchmark(name, size, args.repeat)
+        result = results[name]
+        print("%-24s %s" % (name, "%.4fs" % result['min'] if result['min'] is not None
+                            else result['status']))
+
+    report = OrderedDict([
+        ('blender', bpy.app.version_string),
+        ('size', size),
+        ('results', results)])
+    if args.output:
+        with open(args.output, 'w') as json_file:
+            json.dump(report, json_file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as json_file:
+            baseline = json.load(json_file)
+        if baseline.get('size') != size:
+            print("WARNING: baseline was run with different rig sizes")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("\n%d regressions: %s" % (len(regressions), ', '.join(regressions)))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()